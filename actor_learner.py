@@ -0,0 +1,204 @@
+import multiprocessing as mp
+import queue
+from multiprocessing import shared_memory
+import numpy as np
+from policy import forward, unpack_states
+
+'''
+In the actor-learner mode, collecting experience and learning from it overlap
+instead of taking turns. Several actor processes each play their own Snake
+game with a NumPy copy of the policy and their own fixed epsilon, and stream
+chunks of transitions to the learner through a queue. The learner (the main
+process, which owns TensorFlow) stores them in its replay memory and runs
+replay updates back to back, publishing its weights to shared memory every
+broadcast_every updates for the actors to pick up.
+
+Actors explore by different amounts, following Ape-X (Horgan et al., 2018):
+actor i of N uses epsilon = actor_epsilon**(1 + actor_alpha*i/(N - 1)), so
+some actors mostly explore while others mostly exploit.
+'''
+
+class WeightBroadcast:
+    '''
+    a block of shared memory that holds a version counter and the policy's
+    weights, flattened into one float32 array
+    '''
+    def __init__(self, shapes, name=None):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.sizes = [int(np.prod(shape)) for shape in self.shapes]
+        nbytes = 8 + 4*sum(self.sizes)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner,
+                                              size=nbytes)
+        self.version = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.weights = np.ndarray((sum(self.sizes),), dtype=np.float32,
+                                  buffer=self.shm.buf, offset=8)
+        if self.owner:
+            self.version[0] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def publish(self, weights):
+        '''
+        writes new weights, keeping the version odd while they're half-written
+        '''
+        self.version[0] += 1
+        self.weights[:] = np.concatenate([np.ravel(w) for w in weights])
+        self.version[0] += 1
+
+    def read(self, known_version):
+        '''
+        returns (version, weights) if there are complete weights newer than
+        known_version, otherwise (known_version, None)
+        '''
+        version = int(self.version[0])
+        if version == known_version or version % 2:
+            return known_version, None
+        flat = self.weights.copy()
+        if int(self.version[0]) != version: # The learner wrote mid-copy.
+            return known_version, None
+        weights = np.split(flat, np.cumsum(self.sizes)[:-1])
+        return version, [w.reshape(shape) for w, shape in zip(weights, self.shapes)]
+
+    def close(self):
+        self.version = self.weights = None # Views must go before the memory can close.
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def get_actor_epsilons(num_actors, epsilon=0.4, alpha=7):
+    '''
+    spreads exploration rates over the actors, from epsilon down to epsilon**(1+alpha)
+    '''
+    if num_actors == 1:
+        return [epsilon]
+    return [epsilon**(1 + alpha*i/(num_actors - 1)) for i in range(num_actors)]
+
+def run_actor(index, config, shm_name, shapes, transitions, stop, epsilon,
+              chunk_size):
+    '''
+    plays Snake in an actor process and sends chunks of transitions, and the
+    total, length, and apples of every finished episode, to the learner
+    '''
+    from environment import Snake # Actors never need TensorFlow.
+    env = Snake(config)
+    max_steps = config['params']['max_steps']
+    rng = np.random.default_rng(config['params'].get('seed'))
+    broadcast = WeightBroadcast(shapes, name=shm_name)
+    version, policy_layers = -1, None
+    n = env.obs_size
+    states = np.zeros((chunk_size, n), dtype=env.obs_dtype)
+    actions = np.zeros(chunk_size, dtype=np.int64)
+    rewards = np.zeros(chunk_size, dtype=np.float32)
+    next_states = np.zeros((chunk_size, n), dtype=env.obs_dtype)
+    dones = np.zeros(chunk_size, dtype=np.float32)
+    count = 0
+    try:
+        state = env.reset()
+        total, step_num, apples = 0, 0, 0
+        while not stop.is_set():
+            version, weights = broadcast.read(version)
+            if weights is not None:
+                policy_layers = list(zip(weights[::2], weights[1::2]))
+            if policy_layers is None or rng.random() <= epsilon:
+                action = int(rng.integers(env.action_space))
+            else:
+                inputs = unpack_states(state[None], env.state_space)
+                action = int(np.argmax(forward(policy_layers, inputs)[0]))
+            next_state, reward, done, _ = env.step(action)
+            total += reward
+            step_num += 1
+            apples += reward == 10
+            states[count], actions[count], rewards[count] = state, action, reward
+            next_states[count], dones[count] = next_state, done
+            count += 1
+            if count == chunk_size:
+                transitions.put(('transitions', (states.copy(), actions.copy(),
+                                 rewards.copy(), next_states.copy(), dones.copy())))
+                count = 0
+            state = next_state
+            if done or step_num >= max_steps:
+                transitions.put(('episode', (index, total, step_num, apples)))
+                state = env.reset()
+                total, step_num, apples = 0, 0, 0
+    finally:
+        broadcast.close()
+        env.close()
+
+def train_actor_learner(env, params, timer=None, metrics=None):
+    '''
+    trains a DQN with num_actors actor processes feeding one learner and
+    returns the totals of the first num_episodes episodes the actors finish,
+    streaming their metrics to a MetricsLog if one is given
+    '''
+    from agent import DQN
+    from instrumentation import NULL_TIMER
+    num_actors = params['num_actors']
+    agent = DQN(env, params)
+    agent.timer = timer if timer else NULL_TIMER
+    broadcast = WeightBroadcast([w.shape for w in agent.model.get_weights()])
+    broadcast.publish(agent.model.get_weights())
+    broadcast_every = params.get('broadcast_every', 50)
+    learning_starts = max(params.get('learning_starts', 0), agent.batch_size)
+
+    ctx = mp.get_context('spawn') # Spawned actors don't inherit TensorFlow.
+    # A bounded queue makes actors wait if they get too far ahead.
+    transitions = ctx.Queue(maxsize=8*num_actors)
+    stop = ctx.Event()
+    epsilons = get_actor_epsilons(num_actors, params.get('actor_epsilon', 0.4),
+                                  params.get('actor_alpha', 7))
+    seeds = np.random.SeedSequence(params.get('seed')).generate_state(num_actors)
+    actors = []
+    for index, (epsilon, seed) in enumerate(zip(epsilons, seeds)):
+        actor_config = {'human':False, 'save_for_gif':False,
+                        'params':{**params, 'seed':int(seed)}}
+        actor = ctx.Process(target=run_actor, daemon=True,
+                            args=(index, actor_config, broadcast.name,
+                                  broadcast.shapes, transitions, stop, epsilon,
+                                  params.get('actor_chunk_size', 32)))
+        actor.start()
+        actors.append(actor)
+
+    history = []
+    num_updates = 0
+    if metrics:
+        metrics.begin()
+    try:
+        while len(history) < params['num_episodes']:
+            # Take everything the actors have sent so far, only waiting for
+            # more while there isn't enough memory to learn from.
+            while len(history) < params['num_episodes']:
+                learning = len(agent.memory) >= learning_starts
+                try:
+                    kind, payload = transitions.get(block=not learning, timeout=1)
+                except queue.Empty:
+                    break
+                if kind == 'transitions':
+                    agent.remember(*payload)
+                else:
+                    index, total, length, apples = payload
+                    history.append(total)
+                    if metrics:
+                        metrics.log(len(history) - 1, total, length, apples,
+                                    epsilons[index])
+                    print(f'actor {index:>2} (epsilon {epsilons[index]:.4f}) '
+                          f'{total:<5} ({len(history):>3}/{params["num_episodes"]:<3})')
+            if len(agent.memory) >= learning_starts and agent.replay():
+                num_updates += 1
+                if num_updates % broadcast_every == 0:
+                    broadcast.publish(agent.model.get_weights())
+    finally:
+        stop.set()
+        # Actors blocked on a full queue need it drained before they can stop.
+        while any(actor.is_alive() for actor in actors):
+            try:
+                transitions.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for actor in actors:
+            actor.join()
+        broadcast.close()
+    print(f'the learner made {num_updates} updates')
+    return history
@@ -1,46 +1,65 @@
-import random
 import numpy as np
+from functools import partial
+from instrumentation import NULL_TIMER
 '''
 In deep reinforcement learning, we need to create two things:
     - an environment (the snake game universe)
     - an agent (the algorithm which pilots the snake the environment)
 Our environment is the Snake class and our agent is the neural network.
 '''
-from keras import Sequential
+from memory import ReplayBuffer, PrioritizedReplayBuffer
 '''
-A Sequential deep learning model is appropriate for a plain stack of layers
-where each layer has exactly one input tensor and one output tensor.
+The replay buffer stores transitions in preallocated NumPy arrays with a
+wrapping write cursor, so remembering a step is a few array writes and sampling
+a minibatch is a single fancy-indexing gather per field. The prioritized variant
+replays transitions with large TD errors (e.g. eating an apple or dying) more
+often by sampling from a sum-tree of priorities.
 '''
-from collections import deque
+from policy import forward, export_policy_table, unpack_states
 '''
-Deques are a generalization of stacks and queues (the name is pronounced "deck"
-and is short for "double-ended queue"). Deques support thread-safe, memory
-efficient appends and pops from either side of the deque with approximately the
-same O(1) performance in either direction.
+Acting runs the Q network's forward pass in NumPy on a copy of its weights,
+which skips Keras' per-call overhead and never needs TensorFlow.
 '''
-from keras.layers import Dense
 '''
+TensorFlow and Keras take seconds to import, so DQN.build_model and
+DQN.build_train_step import them only once a network is built. Importing this
+module stays cheap for code that never trains one (e.g. the tabular agent,
+human play, and worker processes), and a DQN with the 'numpy' backend builds
+a NumpyMLP (numpy_mlp.py) instead and never imports them. They use:
+
+A Sequential deep learning model is appropriate for a plain stack of layers
+where each layer has exactly one input tensor and one output tensor.
+
 In any neural network, a dense layer is a layer that is deeply connected with
 its preceding layer which means the neurons of the layer are connected to every
 neuron of its preceding layer. This layer is the most commonly used layer in
 artificial neural network networks.
-'''
-from tensorflow.keras.optimizers import Adam
-'''
+
+TensorFlow's tf.function traces a Python function into a graph once, after
+which each call runs the whole computation (forward passes, loss, gradients,
+and optimizer update) as one graph execution without Keras' per-call overhead.
+
 Adam optimization is a stochastic gradient descent method that is based on
 adaptive estimation of first-order and second order moments. Whereas momentum
 can be seen as a ball running down a slope, Adam behaves like a heavy ball with
 friction, which thus prefers flat minima in the error surface.
 '''
 
+def uses_tensorflow(params):
+    '''
+    checks whether training with these params builds a TensorFlow network
+    '''
+    return params.get('agent', 'dqn') == 'dqn' and params.get('backend', 'keras') == 'keras'
+
 class DQN:
     '''
     a deep-Q neural network that can train itself to play snake
     '''
-    def __init__(self, env, params):
+    def __init__(self, env, params, memory_dir=None):
 
         self.action_space = env.action_space # the dimension of the action space (4 here because the snake's only options are up, down, left, right)
         self.state_space = env.state_space # the dimension of the state space (e.g. 12 binary elements)
+        self.obs_size, self.obs_dtype = env.obs_size, env.obs_dtype # how observations are stored
         self.epsilon = params['epsilon'] # the initial ratio of steps taken to randomly explore vs move in a predicted direction
         self.gamma = params['gamma'] # the discount factor for future rewards (0 is short-sighted; 1 is long-sighted)
         '''
@@ -63,14 +82,42 @@ class DQN:
         self.epsilon_decay = params['epsilon_decay'] # how much of the ratio of random moving we want to take into the next iteration of gathering a batch of states
         self.learning_rate = params['learning_rate'] # to what extent newly acquired info overrides old info (0 learn nothing and exploit prior knowledge exclusively; 1 only consider the most recent information)
         self.layer_sizes = params['layer_sizes'] # the number of nodes for the hidden layers of our Q network
-        self.memory = deque(maxlen=2500) # our defined working memory array of the state of the agent and the environment over time
+        self.prioritized = params.get('prioritized_replay', False) # whether to replay surprising transitions more often
+        self.backend = params.get('backend', 'keras') # what builds and trains the Q network: 'keras' or 'numpy'
+        if self.backend not in ('keras', 'numpy'):
+            raise ValueError(f'unknown backend {self.backend}')
+        self.seed = params.get('seed') # seeds the NumPy network's initial weights
+        self.rng = np.random.default_rng(self.seed) # picks exploratory moves
+        # Given a memory_dir, the replay memory lives in memory-mapped files
+        # there, so checkpoints don't have to copy it.
+        if self.prioritized:
+            self.memory = PrioritizedReplayBuffer(params.get('memory_size', 2500), self.obs_size,
+                                                  alpha=params.get('priority_alpha', 0.6),
+                                                  beta=params.get('priority_beta', 0.4),
+                                                  beta_increment=params.get('priority_beta_increment', 0.001),
+                                                  seed=params.get('seed'), memmap_dir=memory_dir,
+                                                  state_dtype=self.obs_dtype)
+        else:
+            self.memory = ReplayBuffer(params.get('memory_size', 2500), self.obs_size,
+                                       seed=params.get('seed'), memmap_dir=memory_dir,
+                                       state_dtype=self.obs_dtype) # our defined working memory array of the state of the agent and the environment over time
         self.model = self.build_model()
+        self.train_step = self.build_train_step()
+        self.sync_policy()
+        self.timer = NULL_TIMER # A PhaseTimer can be swapped in to time replay().
 
     def build_model(self):
         '''
         builds a neural network of dense layers consisting of an input layer,
         3 hidden layers, and an output layer
         '''
+        if self.backend == 'numpy': # The same network, but in NumPy.
+            from numpy_mlp import NumpyMLP
+            return NumpyMLP(self.state_space, self.layer_sizes, self.action_space,
+                            self.learning_rate, seed=self.seed)
+        from keras import Sequential
+        from keras.layers import Dense
+        from tensorflow.keras.optimizers import Adam
         model = Sequential()
         for i, layer_size in enumerate(self.layer_sizes):
             if i == 0: # The input layer's shape (i.e. number of nodes) is defined by the dimension of the state space.
@@ -90,14 +137,74 @@ class DQN:
         model.compile(loss='mse', optimizer=Adam(learning_rate=self.learning_rate))
         return model
 
+    def build_train_step(self):
+        '''
+        compiles a single graph that computes the Bellman targets for a
+        minibatch and applies one gradient update to the model
+        '''
+        if self.backend == 'numpy': # NumPy runs the same step without a graph.
+            return partial(self.model.train_step, gamma=self.gamma)
+        import tensorflow as tf
+        from checkpoint import build_optimizer
+        model = self.model
+        optimizer = model.optimizer
+        build_optimizer(optimizer, model.trainable_variables)
+        gamma = self.gamma
+        action_space = self.action_space
+
+        @tf.function(input_signature=[
+            tf.TensorSpec([None, self.state_space], tf.float32), # states
+            tf.TensorSpec([None], tf.int64),                     # actions
+            tf.TensorSpec([None], tf.float32),                   # rewards
+            tf.TensorSpec([None, self.state_space], tf.float32), # next states
+            tf.TensorSpec([None], tf.float32),                   # dones
+            tf.TensorSpec([None], tf.float32)])                  # sample weights
+        def train_step(states, actions, rewards, next_states, dones, weights):
+            n = tf.shape(states)[0]
+            taken = tf.one_hot(actions, action_space)
+            with tf.GradientTape() as tape:
+                # Q(s) and Q(s') come from one forward pass over both batches.
+                q_values = model(tf.concat([states, next_states], axis=0), training=True)
+                q, q_next = q_values[:n], tf.stop_gradient(q_values[n:])
+                targets = rewards + gamma*tf.reduce_max(q_next, axis=1)*(1-dones)
+                # Only the actions taken move toward their targets; the other
+                # outputs are their own targets, just like in a fit call.
+                targets_full = tf.stop_gradient(q*(1-taken) + taken*targets[:, None])
+                losses = tf.reduce_mean(tf.square(targets_full - q), axis=1)
+                loss = tf.reduce_mean(losses*weights)
+            gradients = tape.gradient(loss, model.trainable_variables)
+            optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+            # The TD errors are what prioritized replay uses as priorities.
+            return targets - tf.reduce_sum(q*taken, axis=1)
+        return lambda *batch: train_step(*batch).numpy()
+
+
+    def sync_policy(self):
+        '''
+        copies the model's weights into NumPy arrays for fast action selection
+        '''
+        weights = self.model.get_weights()
+        # Keras lists each Dense layer's kernel followed by its bias.
+        self.policy_layers = list(zip(weights[::2], weights[1::2]))
+        self.policy_stale = False
+
+    def predict(self, states):
+        '''
+        runs the Q network's forward pass in NumPy on an (N, state_space)
+        array of states, which for a network this small is far faster than a
+        Keras predict call
+        '''
+        if self.policy_stale: # Pick up the weights of the latest update.
+            self.sync_policy()
+        return forward(self.policy_layers, unpack_states(states, self.state_space))
 
     def remember(self, state, action, reward, next_state, done):
         '''
         adds the current state, next state, proposed action, total reward, and
-        whether we are done in the agent's running memory buffer (deque) of
-        states
+        whether we are done in the agent's running memory buffer of states
+        (either one transition or a batch with one row per transition)
         '''
-        self.memory.append((state, action, reward, next_state, done))
+        self.memory.add(state, action, reward, next_state, done)
 
 
     def act(self, state):
@@ -108,13 +215,25 @@ class DQN:
         # If we are under the explore threshold parameter, move in a random
         # direction, otherwise move in the direction which maximizes the
         # probability of a larger total reward.
-        if np.random.rand() <= self.epsilon:
-            return random.randrange(self.action_space)
-        act_values = self.model.predict(state)
+        if self.rng.random() <= self.epsilon:
+            return int(self.rng.integers(self.action_space))
+        act_values = self.predict(state)
         # e.g. [[0.08789534, 0.8699538 , 0.03103394, 0.01111698]]
         #           0:up      1:down      2:left      3:right
         return np.argmax(act_values[0])
 
+    def act_batch(self, states):
+        '''
+        picks one action per row of an (N, state_space) array of states with a
+        single prediction call
+        '''
+        actions = self.rng.integers(self.action_space, size=len(states))
+        greedy = self.rng.random(len(states)) > self.epsilon
+        if greedy.any():
+            act_values = self.predict(states[greedy])
+            actions[greedy] = np.argmax(act_values, axis=1)
+        return actions
+
     '''
     A note on batch size from Deep Learning by Ian Goodfellow:
 
@@ -157,58 +276,259 @@ class DQN:
     '''
     def replay(self):
         '''
-        retrains the DQN
+        retrains the DQN and returns whether it had enough samples to do so
         '''
          # Collect more samples if we don't have  enough for a training batch.
         if len(self.memory) < self.batch_size:
-            return
+            return False
 
+        replay_start = start = self.timer.now()
         # Get a batch_size'd random sample from the working memory buffer.
-        minibatch = random.sample(self.memory, self.batch_size)
-        states = np.array([memory[0] for memory in minibatch])
-        actions = np.array([memory[1] for memory in minibatch])
-        rewards = np.array([memory[2] for memory in minibatch])
-        next_states = np.array([memory[3] for memory in minibatch])
-        dones = np.array([memory[4] for memory in minibatch])
-        # Convert the state vectors from 1x12 matrices to 12-element arrays.
-        states = np.squeeze(states)
-        next_states = np.squeeze(next_states)
+        # Prioritized samples come with importance-sampling weights that scale
+        # each transition's contribution to the loss.
+        weights = np.ones(self.batch_size, dtype=np.float32)
+        if self.prioritized:
+            states, actions, rewards, next_states, dones, indices, weights =\
+                self.memory.sample(self.batch_size)
+        else:
+            states, actions, rewards, next_states, dones =\
+                self.memory.sample(self.batch_size)
+        # Bit-packed observations are only unpacked for the network.
+        states = unpack_states(states, self.state_space)
+        next_states = unpack_states(next_states, self.state_space)
+        self.timer.add('agent.replay/sample', start)
 
         # The core of this algorithm is a Bellman equation as a simple value
         # iteration update, using the weighted average of the old value and the
-        # new information.
-        targets = rewards + self.gamma*(np.amax(self.model.predict_on_batch(next_states), axis=1))*(1-dones)
-        targets_full = self.model.predict_on_batch(states)
-        ind = np.arange(self.batch_size)
-        targets_full[[ind], [actions]] = targets
-
-        self.model.fit(states, targets_full, epochs=1, verbose=0)
-        # Attenuate the random exploration parameter as the model learns.
+        # new information. The compiled train step computes the targets and
+        # fits the model to them in one call, so targets and fit share a phase.
+        start = self.timer.now()
+        td_errors = self.train_step(states, actions, rewards, next_states,
+                                    dones, weights)
+        self.timer.add('agent.replay/train_step', start)
+        # Refresh the NumPy copy of the weights the next time we act.
+        self.policy_stale = True
+        if self.prioritized:
+            start = self.timer.now()
+            self.memory.update_priorities(indices, td_errors)
+            self.timer.add('agent.replay/priorities', start)
+        self.timer.add('agent.replay', replay_start)
+        return True
+
+    def replay_offline(self, dataset, num_epochs=1, seed=None):
+        '''
+        fits the DQN to the episodes of a TrajectoryDataset, streamed in
+        shuffled batches, and returns the mean absolute TD error of each epoch
+        '''
+        rng = np.random.default_rng(seed)
+        mean_errors = []
+        for _ in range(num_epochs):
+            total_error, count = 0.0, 0
+            for states, actions, rewards, next_states, dones in\
+                    dataset.iter_batches(self.batch_size, seed=rng.integers(2**32)):
+                weights = np.ones(len(states), dtype=np.float32)
+                td_errors = self.train_step(states, actions, rewards, next_states,
+                                            dones, weights)
+                total_error += np.abs(td_errors).sum()
+                count += len(td_errors)
+            mean_errors.append(float(total_error)/max(count, 1))
+        self.policy_stale = True
+        return mean_errors
+
+    def decay_epsilon(self):
+        '''
+        attenuates the random exploration parameter as the model learns
+        '''
         if self.epsilon > self.epsilon_min:
             self.epsilon *= self.epsilon_decay
 
-def train_dqn(env, params):
-    history = []
-    agent = DQN(env, params)
-    for episode_num in range(params['num_episodes']):
-        state = env.reset()
-        # Convert the initial state to a 1x12 matrix.
-        state = np.reshape(state, (1, env.state_space))
-        total_reward = 0
+class UpdateScheduler:
+    '''
+    decides how environment steps and learning interleave: when the agent
+    replays, how many gradient steps it takes, and when epsilon decays
+    '''
+    def __init__(self, params):
+        self.train_freq = params.get('train_freq', 1) # env steps between rounds of training
+        self.gradient_steps = params.get('gradient_steps', 1) # replay calls per round of training
+        self.learning_starts = params.get('learning_starts', 0) # env steps to collect before any training
+        # Epsilon decays after every 'update' (i.e. replay call that trained),
+        # every env 'step', or every finished 'episode'.
+        self.epsilon_decay_freq = params.get('epsilon_decay_freq', 'update')
+        if self.epsilon_decay_freq not in ('update', 'step', 'episode'):
+            raise ValueError(f'unknown epsilon_decay_freq {self.epsilon_decay_freq}')
+        self.num_steps = 0 # env.step calls so far (one per batch for vectorized envs)
+
+    def on_step(self, agent):
+        '''
+        lets the agent learn (or not) after one call to env.step
+        '''
+        self.num_steps += 1
+        if self.epsilon_decay_freq == 'step':
+            agent.decay_epsilon()
+        # We can include online gradient descent (i.e. batch_size=1) later.
+        if agent.batch_size <= 1 or self.num_steps <= self.learning_starts:
+            return
+        if self.num_steps % self.train_freq:
+            return
+        for _ in range(self.gradient_steps):
+            if agent.replay() and self.epsilon_decay_freq == 'update':
+                agent.decay_epsilon()
+
+    def on_episode_end(self, agent):
+        '''
+        lets epsilon decay once a game ends if it's on a per-episode cadence
+        '''
+        if self.epsilon_decay_freq == 'episode':
+            agent.decay_epsilon()
+
+def make_agent(env, params, memory_dir=None):
+    '''
+    creates the agent that params['agent'] asks for: a 'dqn' (the default) or
+    a 'tabular' Q-table
+    '''
+    kind = params.get('agent', 'dqn')
+    if kind == 'tabular':
+        from tabular import TabularQ
+        return TabularQ(env, params, memory_dir=memory_dir)
+    if kind != 'dqn':
+        raise ValueError(f'unknown agent {kind}')
+    return DQN(env, params, memory_dir=memory_dir)
+
+def progress_line(state, total_reward, episode, params):
+    '''
+    formats the line printed when an episode ends, which leads with its final
+    observation unless that's an unreadable bit-packed 'grid' one
+    '''
+    line = f'{total_reward:<5} ({episode:>3}/{params["num_episodes"]:<3})'
+    if params['state_definition_type'] == 'grid':
+        return line
+    return f'{str(state)} {line}'
+
+def train_dqn(env, params, timer=NULL_TIMER, profiler=None, checkpointer=None,
+              table_path=None, metrics=None):
+    '''
+    trains a DQN, optionally timing each phase of the loop with a PhaseTimer,
+    profiling chosen episodes with an EpisodeProfiler, saving (and resuming
+    from) checkpoints with a Checkpointer, compiling the trained policy into a
+    lookup table saved to table_path, and streaming each episode's metrics to
+    a MetricsLog
+    '''
+    if params.get('num_actors', 1) > 1: # Actor processes collect experience.
+        from actor_learner import train_actor_learner
+        return train_actor_learner(env, params, timer, metrics)
+    if hasattr(env, 'num_envs'): # Vectorized environments step in batches.
+        return train_dqn_vec(env, params, timer, profiler, checkpointer,
+                             table_path, metrics)
+    agent = make_agent(env, params, memory_dir=checkpointer.memory_dir if checkpointer else None)
+    env.timer = agent.timer = timer
+    scheduler = UpdateScheduler(params)
+    first_episode, history = checkpointer.restore(agent, env, scheduler)\
+        if checkpointer else (0, [])
+    if metrics:
+        metrics.begin(first_episode)
+    # The environment writes observations straight into these two buffers,
+    # taking turns so that the previous state is never overwritten before
+    # it's remembered.
+    buffers = np.zeros((2, 1, env.obs_size), dtype=env.obs_dtype)
+    for episode_num in range(first_episode, params['num_episodes']):
+        if profiler:
+            profiler.begin(episode_num)
+        state = env.reset(out=buffers[0])
+        total_reward = apples = 0
         for step_num in range(params['max_steps']):
+            start = timer.now()
             action = agent.act(state)
+            timer.add('agent.act', start)
             prev_state = state
             # The step method allows the agent to move the snake.
-            next_state, reward, done, info = env.step(action, episode_num, step_num)
+            next_state, reward, done, info = env.step(action, episode_num, step_num,
+                                                      out=buffers[(step_num+1)%2])
             total_reward += reward
-            next_state = np.reshape(next_state, (1, env.state_space))
+            apples += reward == 10
+            start = timer.now()
             agent.remember(state, action, reward, next_state, done)
+            timer.add('agent.remember', start)
             state = next_state
-            # We can include online gradient descent (i.e. batch_size=1) later.
-            if agent.batch_size > 1:
-                agent.replay()
+            scheduler.on_step(agent)
             if done:
-                print(f'{str(prev_state)} {total_reward:<5} ({episode_num+1:>3}/{params["num_episodes"]:<3})')
+                print(progress_line(prev_state, total_reward, episode_num + 1, params))
                 break
+        scheduler.on_episode_end(agent)
         history.append(total_reward)
+        if metrics:
+            metrics.log(episode_num, total_reward, step_num + 1, apples, agent.epsilon)
+        timer.end_episode(episode_num)
+        if profiler:
+            profiler.end(episode_num)
+        if checkpointer:
+            checkpointer.on_episode_end(episode_num, agent, env, scheduler, history)
+    if table_path:
+        export_policy_table(agent, table_path)
+    return history
+
+def train_dqn_vec(env, params, timer=NULL_TIMER, profiler=None, checkpointer=None,
+                  table_path=None, metrics=None):
+    '''
+    Trains a DQN on a vectorized environment that steps every game at once and
+    resets finished games by itself.
+
+    Timings cover whole batched calls and are written each time an episode
+    finishes, and profiling runs from when the chosen episode's predecessor
+    finished until it finishes itself. Games that are still running when a
+    checkpoint is saved start over when training resumes.
+    '''
+    agent = make_agent(env, params, memory_dir=checkpointer.memory_dir if checkpointer else None)
+    agent.timer = timer
+    scheduler = UpdateScheduler(params)
+    first_episode, history = checkpointer.restore(agent, env, scheduler)\
+        if checkpointer else (0, [])
+    if metrics:
+        metrics.begin(first_episode)
+    states = env.reset()
+    totals = np.zeros(env.num_envs, dtype=np.int64)
+    lengths = np.zeros(env.num_envs, dtype=np.int64)
+    apples = np.zeros(env.num_envs, dtype=np.int64)
+    if profiler:
+        profiler.begin(first_episode)
+    while len(history) < params['num_episodes']:
+        start = timer.now()
+        actions = agent.act_batch(states)
+        timer.add('agent.act', start)
+        start = timer.now()
+        next_states, rewards, dones, info = env.step(actions)
+        timer.add('env.step', start)
+        totals += rewards
+        lengths += 1
+        apples += rewards == 10
+        # Finished games already hold the next episode's first observation, so
+        # remember the final observation they ended on instead.
+        finished = np.flatnonzero(dones | info['truncated'])
+        final_states = next_states.copy()
+        if len(finished):
+            final_states[finished] = info['terminal_observation']
+        start = timer.now()
+        agent.remember(states, actions, rewards, final_states, dones)
+        timer.add('agent.remember', start)
+        scheduler.on_step(agent)
+        for i in finished:
+            if len(history) < params['num_episodes']:
+                history.append(int(totals[i]))
+                print(progress_line(states[i:i+1], totals[i], len(history), params))
+                if metrics:
+                    metrics.log(len(history) - 1, int(totals[i]), int(lengths[i]),
+                                int(apples[i]), agent.epsilon)
+                timer.end_episode(len(history) - 1)
+                if profiler:
+                    profiler.end(len(history) - 1)
+                    profiler.begin(len(history))
+                if checkpointer:
+                    checkpointer.on_episode_end(len(history) - 1, agent, env,
+                                                scheduler, history)
+            scheduler.on_episode_end(agent)
+            totals[i] = lengths[i] = apples[i] = 0
+        # Worker pools hand back views of shared memory that the next step
+        # overwrites, so keep a copy of the observations.
+        states = next_states.copy()
+    if table_path:
+        export_policy_table(agent, table_path)
     return history
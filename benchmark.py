@@ -0,0 +1,307 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from datetime import datetime
+import io
+import json
+import math
+import platform
+import sys
+import time
+import numpy as np
+from policy import TablePolicy, export_policy_table
+from tabular import BINARY_STATE_DEFINITIONS
+
+'''
+Measures how fast the environments step and how fast the agent acts and
+learns, then saves the numbers as JSON. Comparing a run against a saved
+baseline flags every result that got worse by more than a tolerance, so
+throughput regressions show up before they are merged.
+
+Everything runs headless and offline, e.g.
+    python benchmark.py -o baseline.json
+    python benchmark.py -o new.json -b baseline.json
+'''
+
+def parse_args():
+    '''defines our CLI options'''
+    parser = ArgumentParser(prog='Snake RL benchmarks',
+                            description='measure environment and agent throughput')
+    parser.add_argument('-c', '--config', dest='config', required=False,
+                        default='config.json',
+                        help='path to the configuration file whose params are benchmarked')
+    parser.add_argument('-o', '--out', dest='out', required=False,
+                        default='benchmark.json',
+                        help='path to save the results to')
+    parser.add_argument('-b', '--baseline', dest='baseline', required=False,
+                        help='path to earlier results to check for regressions')
+    parser.add_argument('-t', '--tolerance', dest='tolerance', type=float,
+                        default=0.1,
+                        help='how much worse (as a fraction) a result may get')
+    parser.add_argument('-s', '--suites', dest='suites', nargs='+',
+                        default=['startup', 'env', 'vec', 'replay', 'act', 'train'],
+                        choices=['startup', 'env', 'vec', 'replay', 'act', 'train'],
+                        help='which benchmarks to run')
+    parser.add_argument('-q', '--quick', dest='quick', action='store_true',
+                        help='run fewer iterations for a rough result')
+    return parser.parse_args()
+
+def get_benchmark_config(path):
+    '''
+    loads a config and makes it headless
+    '''
+    with open(path) as json_file:
+        config = json.load(json_file)
+    config.update({'human':False, 'save_for_gif':False, 'make_gif':False,
+                   'record_trajectories':False})
+    config['params'].setdefault('seed', 0)
+    return config
+
+def set_snake_length(env, length):
+    '''
+    resets a Snake and coils a body of the given length back and forth across
+    the top rows of the board, heading down from the end of the coil
+    '''
+    env.reset()
+    path = []
+    for row, y in enumerate(range(env.y_max, -env.y_max - 1, -1)):
+        xs = range(-env.x_max, env.x_max + 1)
+        path.extend((x, y) for x in (xs if row % 2 else reversed(xs)))
+    # The body starts at the head, which is the end of the path.
+    cells = [env.to_cell(x, y) for x, y in path[:length]][::-1]
+    if cells:
+        env.head_cell = cells[0]
+        env.direction = 'down'
+    for cell in cells:
+        env.body.append(cell)
+        env.occupancy[cell] += 1
+        env.occupy(cell)
+    if env.occupancy[env.apple_cell] or env.apple_cell == env.head_cell:
+        env.spawn_apple(first=True)
+    env.dist = math.dist(env.head, env.apple)
+
+def bench_env(config, quick):
+    '''
+    measures Snake steps per second for every state definition and several
+    snake lengths
+    '''
+    from environment import Snake, STATE_ENCODERS
+    num_steps = 2000 if quick else 20000
+    rng = np.random.default_rng(0)
+    results = {}
+    for state_definition_type in STATE_ENCODERS:
+        for length in [0, 20, 100]:
+            env = Snake({**config, 'params':{**config['params'],
+                         'state_definition_type':state_definition_type}})
+            out = np.zeros(env.obs_size, dtype=env.obs_dtype)
+            actions = rng.integers(env.action_space, size=num_steps)
+            set_snake_length(env, length)
+            elapsed = 0.0
+            for action in actions:
+                # Only the step is timed; regrowing a crashed snake is not.
+                start = time.perf_counter()
+                _, _, done, _ = env.step(int(action), out=out)
+                elapsed += time.perf_counter() - start
+                if done:
+                    set_snake_length(env, length)
+            env.close()
+            results[f'env/{state_definition_type}/len{length}/steps_per_sec'] =\
+                {'value':num_steps/elapsed, 'unit':'steps/s', 'higher_is_better':True}
+    return results
+
+def bench_vec(config, quick):
+    '''
+    measures SnakeVecEnv game steps per second (games times batched steps) for
+    several batch sizes
+    '''
+    from environment import SnakeVecEnv
+    num_steps = 200 if quick else 2000
+    rng = np.random.default_rng(0)
+    results = {}
+    for num_envs in [1, 16, 256]:
+        env = SnakeVecEnv(config, num_envs=num_envs, seed=0)
+        env.reset()
+        actions = rng.integers(4, size=(num_steps, num_envs))
+        start = time.perf_counter()
+        for step_actions in actions:
+            env.step(step_actions)
+        elapsed = time.perf_counter() - start
+        env.close()
+        results[f'vec/{num_envs}envs/steps_per_sec'] =\
+            {'value':num_steps*num_envs/elapsed, 'unit':'steps/s',
+             'higher_is_better':True}
+    return results
+
+def random_observations(env, rng, num):
+    '''
+    draws num random binary observations stored the way env stores them, i.e.
+    as (num, obs_size) rows that are bit-packed when obs_dtype is uint8
+    '''
+    bits = rng.integers(2, size=(num, env.state_space))
+    if env.obs_dtype == np.uint8:
+        return np.packbits(bits.astype(np.uint8), axis=1)
+    return bits.astype(env.obs_dtype)
+
+def make_agent(config, batch_size, layer_sizes):
+    '''
+    creates a DQN whose replay memory is already full of random transitions
+    '''
+    from agent import DQN
+    from environment import Snake
+    env = Snake(config)
+    params = {**config['params'], 'batch_size':batch_size, 'layer_sizes':layer_sizes}
+    agent = DQN(env, params)
+    rng = np.random.default_rng(0)
+    n = max(10*batch_size, 1000)
+    agent.remember(random_observations(env, rng, n),
+                   rng.integers(env.action_space, size=n),
+                   rng.choice([-100, -1, 1, 10], size=n),
+                   random_observations(env, rng, n),
+                   rng.random(n) < 0.01)
+    return env, agent
+
+def bench_replay(config, quick):
+    '''
+    measures remember+replay updates per second for several batch sizes and
+    network shapes, on the Keras backend and again on the NumPy one
+    '''
+    num_updates = 20 if quick else 200
+    results = {}
+    for backend, prefix in [('keras', 'replay'), ('numpy', 'replay/numpy')]:
+        backend_config = {**config, 'params':{**config['params'], 'backend':backend}}
+        for batch_size in [32, 256]:
+            for layer_sizes in [[128, 128, 128], [256, 256]]:
+                env, agent = make_agent(backend_config, batch_size, layer_sizes)
+                state = np.zeros((1, env.obs_size), dtype=env.obs_dtype)
+                agent.replay() # The first update compiles the train step.
+                start = time.perf_counter()
+                for _ in range(num_updates):
+                    agent.remember(state, 0, 1, state, False)
+                    agent.replay()
+                elapsed = time.perf_counter() - start
+                shape = 'x'.join(str(size) for size in layer_sizes)
+                results[f'{prefix}/batch{batch_size}/layers{shape}/updates_per_sec'] =\
+                    {'value':num_updates/elapsed, 'unit':'updates/s',
+                     'higher_is_better':True}
+    return results
+
+def bench_act(config, quick):
+    '''
+    measures the latency percentiles of greedy DQN.act calls, and of the
+    same policy compiled into a lookup table when the states are binary
+    '''
+    num_calls = 1000 if quick else 10000
+    env, agent = make_agent(config, config['params']['batch_size'],
+                            config['params']['layer_sizes'])
+    agent.epsilon = 0 # Always ask the network.
+    states = random_observations(env, np.random.default_rng(0),
+                                 num_calls).reshape(num_calls, 1, env.obs_size)
+    latencies = np.empty(num_calls)
+    for i, state in enumerate(states):
+        start = time.perf_counter()
+        agent.act(state)
+        latencies[i] = time.perf_counter() - start
+    results = {f'act/p{q}_latency_us':{'value':np.percentile(latencies, q)*1e6,
+                                       'unit':'us', 'higher_is_better':False}
+               for q in [50, 90, 99]}
+    if env.state_definition_type in BINARY_STATE_DEFINITIONS:
+        # The same policy compiled into a lookup table.
+        policy = TablePolicy(export_policy_table(agent))
+        for i, state in enumerate(states):
+            start = time.perf_counter()
+            policy.act(state)
+            latencies[i] = time.perf_counter() - start
+        results.update({f'act/table/p{q}_latency_us':
+                        {'value':np.percentile(latencies, q)*1e6, 'unit':'us',
+                         'higher_is_better':False} for q in [50, 90, 99]})
+    return results
+
+def bench_train(config, quick):
+    '''
+    measures end-to-end train_dqn episodes per second for several batch sizes
+    and network shapes
+    '''
+    from agent import train_dqn
+    from environment import Snake
+    num_episodes = 3 if quick else 10
+    results = {}
+    for batch_size in [32, 256]:
+        for layer_sizes in [[128, 128, 128], [256, 256]]:
+            params = {**config['params'], 'batch_size':batch_size,
+                      'layer_sizes':layer_sizes, 'num_episodes':num_episodes,
+                      'max_steps':200}
+            env = Snake({**config, 'params':params})
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()): # Skip the per-episode logs.
+                train_dqn(env, params)
+            elapsed = time.perf_counter() - start
+            env.close()
+            shape = 'x'.join(str(size) for size in layer_sizes)
+            results[f'train/batch{batch_size}/layers{shape}/episodes_per_sec'] =\
+                {'value':num_episodes/elapsed, 'unit':'episodes/s',
+                 'higher_is_better':True}
+    return results
+
+def bench_startup(config, quick):
+    '''
+    measures how long the modules that every run (or worker process) starts
+    with take to import in a fresh interpreter
+    '''
+    from instrumentation import measure_import_cost
+    results = {}
+    for module in ['explore', 'environment', 'agent', 'workers']:
+        seconds, _ = measure_import_cost(module)
+        if seconds is not None:
+            results[f'startup/import_{module}_ms'] = {'value':1000*seconds,
+                                                      'unit':'ms',
+                                                      'higher_is_better':False}
+    return results
+
+BENCHMARKS = {'startup':bench_startup, 'env':bench_env, 'vec':bench_vec,
+              'replay':bench_replay, 'act':bench_act, 'train':bench_train}
+
+def compare(results, baseline, tolerance):
+    '''
+    returns the names of results that are more than `tolerance` worse than the
+    baseline, printing how every shared result changed
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['value'], result['value']
+        change = (new - old)/old if old else 0.0
+        worse = -change if result['higher_is_better'] else change
+        flag = 'REGRESSION' if worse > tolerance else ''
+        if flag:
+            regressions.append(name)
+        print(f'{name:<55} {old:>12.1f} -> {new:>12.1f} {result["unit"]:<11} {change:>+7.1%} {flag}')
+    return regressions
+
+def main():
+    args = parse_args()
+    config = get_benchmark_config(args.config)
+    results = {}
+    for suite in args.suites:
+        print(f'running {suite} benchmarks')
+        results.update(BENCHMARKS[suite](config, args.quick))
+    report = {'meta':{'timestamp':datetime.now().isoformat(),
+                      'python':platform.python_version(),
+                      'numpy':np.__version__, 'platform':platform.platform(),
+                      'quick':args.quick},
+              'results':results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=4)
+    for name, result in results.items():
+        print(f'{name:<55} {result["value"]:>12.1f} {result["unit"]}')
+    print(f'results saved to {args.out}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'ERROR: {len(regressions)} result(s) regressed by more than {args.tolerance:.0%}')
+            sys.exit(1)
+        print('no regressions')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import os
+import pickle
+import random
+import shutil
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+'''
+A checkpoint folder holds what's needed to pick training up where it was saved:
+
+- weights.npz and optimizer.npz hold the model's weights and Adam's slots
+  (or just a tabular agent's Q-table).
+- state.pkl holds epsilon, the history, the update schedule's step count, the
+  replay buffer's cursor (and priorities), and the states of the Python, NumPy,
+  environment, and agent exploration RNGs as they were at the save.
+
+A resumed run starts from those weights, optimizer slots, counters, and RNGs,
+but it isn't promised to match a run that was never interrupted. The replay
+buffer's transitions aren't copied into checkpoints. They live in
+memory-mapped files in the shared `memory` folder, which are flushed with each
+checkpoint, so any transitions written after the last checkpoint stay there
+and may have overwritten older ones that the checkpoint still counts.
+
+Every checkpoint is written to a temporary folder on a background thread and
+then renamed into place, and the `latest` file is swapped in the same way, so
+a crash mid-write never leaves a half-written checkpoint behind.
+'''
+
+def get_optimizer_variables(optimizer):
+    '''
+    returns an optimizer's variables, which Keras 3 (and NumpyAdam) list in a
+    property and Keras 2 returns from a method
+    '''
+    variables = optimizer.variables
+    return variables() if callable(variables) else variables
+
+def build_optimizer(optimizer, variables):
+    '''
+    creates an optimizer's slots for the given variables up front, rather than
+    on its first update, so that they can be saved and restored
+    '''
+    if hasattr(optimizer, 'build'): # Keras 3
+        optimizer.build(variables)
+    elif hasattr(optimizer, '_create_all_weights'): # Keras 2
+        optimizer._create_all_weights(variables)
+
+class Checkpointer:
+    '''
+    saves and restores training checkpoints in a run's instance folder
+    '''
+    def __init__(self, checkpoint_dir:Path, every=0, keep=2):
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.checkpoint_dir.mkdir(exist_ok=True, parents=True)
+        self.memory_dir = self.checkpoint_dir/'memory'
+        self.every = every # episodes between checkpoints (0 never saves)
+        self.keep = keep   # how many of the newest checkpoints to keep
+        # A single thread writes checkpoints one after another in order.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def on_episode_end(self, episode_num, agent, env, scheduler, history):
+        '''
+        saves a checkpoint if one is due after this episode
+        '''
+        if self.pending is not None and self.pending.done():
+            self.pending.result() # Surface a failed write as soon as it's over.
+        if self.every and (episode_num + 1) % self.every == 0:
+            self.save(episode_num, agent, env, scheduler, history)
+
+    def save(self, episode_num, agent, env, scheduler, history):
+        '''
+        snapshots the training state right away and writes it in the background
+        '''
+        # Everything is copied now, so training can carry on while it's written.
+        if hasattr(agent, 'q_table'): # A tabular agent's table is its weights.
+            weights, optimizer = [agent.q_table.copy()], []
+        else:
+            weights = agent.model.get_weights()
+            optimizer = [np.array(variable) for variable in
+                         get_optimizer_variables(agent.model.optimizer)]
+        state = {'episode_num':episode_num,
+                 'epsilon':agent.epsilon,
+                 'history':list(history),
+                 'num_steps':scheduler.num_steps,
+                 'memory':agent.memory.get_state(),
+                 'random':random.getstate(),
+                 'np_random':np.random.get_state(),
+                 'agent_rng':agent.rng,
+                 'env':{name:getattr(env, name) for name in
+                        ('rng', 'apple_cell', 'dist', 'maximum') if hasattr(env, name)}}
+        state = pickle.dumps(state) # Pickling copies the RNGs as they are now.
+        if self.pending is not None:
+            self.pending.result() # Surface any error from the last write.
+        self.pending = self.executor.submit(self.write, episode_num, weights,
+                                            optimizer, state, agent.memory)
+
+    def write(self, episode_num, weights, optimizer, state, memory):
+        name = f'ckpt-ep{episode_num:09d}'
+        tmp_dir = self.checkpoint_dir/f'{name}.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+        np.savez(tmp_dir/'weights.npz', *weights)
+        np.savez(tmp_dir/'optimizer.npz', *optimizer)
+        with open(tmp_dir/'state.pkl', 'wb') as f:
+            f.write(state)
+        memory.flush()
+        # A run that resumed from an older checkpoint can get to one that's
+        # already there, and a folder can only be renamed over an empty one.
+        shutil.rmtree(self.checkpoint_dir/name, ignore_errors=True)
+        os.replace(tmp_dir, self.checkpoint_dir/name)
+        tmp_latest = self.checkpoint_dir/'latest.tmp'
+        tmp_latest.write_text(name)
+        os.replace(tmp_latest, self.checkpoint_dir/'latest')
+        # Older checkpoints go only after the newer one is in place.
+        checkpoints = sorted(self.checkpoint_dir.glob('ckpt-ep*[0-9]'))
+        for old in checkpoints[:-self.keep]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def latest(self):
+        '''
+        returns the newest complete checkpoint folder, or None if there's none
+        '''
+        latest = self.checkpoint_dir/'latest'
+        if not latest.exists():
+            return None
+        return self.checkpoint_dir/latest.read_text().strip()
+
+    def restore(self, agent, env, scheduler):
+        '''
+        loads the newest checkpoint into the agent, environment, and update
+        schedule and returns (the next episode number, the history so far), or
+        (0, []) if there's no checkpoint yet
+        '''
+        ckpt_dir = self.latest()
+        if ckpt_dir is None:
+            return 0, []
+        with np.load(ckpt_dir/'weights.npz') as f:
+            weights = [f[f'arr_{i}'] for i in range(len(f.files))]
+        if hasattr(agent, 'q_table'):
+            agent.q_table[:] = weights[0]
+        else:
+            agent.model.set_weights(weights)
+            variables = get_optimizer_variables(agent.model.optimizer)
+            with np.load(ckpt_dir/'optimizer.npz') as f:
+                if len(f.files) == len(variables):
+                    for i, variable in enumerate(variables):
+                        variable.assign(f[f'arr_{i}'])
+                else: # e.g. saved by another Keras version, which lists them differently
+                    print(f'the optimizer state in {ckpt_dir} doesn\'t fit, so it starts over')
+            agent.sync_policy()
+        with open(ckpt_dir/'state.pkl', 'rb') as f:
+            state = pickle.load(f)
+        agent.epsilon = state['epsilon']
+        agent.memory.set_state(state['memory'])
+        scheduler.num_steps = state['num_steps']
+        random.setstate(state['random'])
+        np.random.set_state(state['np_random'])
+        if 'agent_rng' in state: # Older checkpoints didn't save it.
+            agent.rng = state['agent_rng']
+        for name, value in state['env'].items():
+            setattr(env, name, value)
+        # Checkpoints newer than this one (e.g. if a crash came between a
+        # folder's rename and the swap of `latest`) belong to a future that
+        # won't happen now.
+        for newer in self.checkpoint_dir.glob('ckpt-ep*[0-9]'):
+            if newer.name > ckpt_dir.name:
+                shutil.rmtree(newer, ignore_errors=True)
+        print(f'resuming from {ckpt_dir}')
+        return state['episode_num'] + 1, state['history']
+
+    def close(self):
+        '''
+        waits for the last checkpoint to finish writing
+        '''
+        self.executor.shutdown(wait=True)
+        if self.pending is not None:
+            self.pending.result()
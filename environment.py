@@ -1,257 +1,295 @@
-import turtle
 import random
 import time
 import math
 import gym
 import sys
+import numpy as np
+from collections import deque
+from functools import lru_cache
 from pathlib import Path
+from instrumentation import NULL_TIMER
 
 class Snake(gym.Env):
     '''
     a game environment where a user (or AI agent) can play Snake
     '''
-    FONT_FAM = 'Courier'
-    FONT_SIZE = 18
-    FONT_ALIGN = 'center'
-    FONT_STYLE = 'normal'
-    HEAD_SIZE = 20              # side length of the square snake head in pixels
-    HEIGHT = WIDTH = 20         # side length of square screen in snake heads
-    PIXEL_H = HEAD_SIZE*HEIGHT  # height of the screen in pixels
-    PIXEL_W = HEAD_SIZE*WIDTH   # width of the screen in pixels
+    HEIGHT = WIDTH = 20         # default side length of the screen in snake heads
     SLEEP = 0.1                 # seconds to wait between steps for humans
-    GAME_TITLE = 'Snake'
-    BG_COLOR = tuple(i/255.0 for i in (242,225,242)) # lavender
-    SNAKE_SHAPE = 'square'
-    SNAKE_COLOR = 'green'
-    SNAKE_SPEED = 'fastest'
-    SNAKE_START_X = HEAD_SIZE*0 # The origin is in the center of the screen.
-    SNAKE_START_Y = HEAD_SIZE*0 # Starting coordinates are in units of pixels.
-    APPLE_SHAPE = 'circle'
-    APPLE_COLOR = 'red'
+    SNAKE_START_X = 0           # The origin is in the center of the screen.
+    SNAKE_START_Y = 0           # Coordinates are in units of snake heads.
+    WALL = -1                   # occupancy value of the cells around the board
 
     def __init__(self, config):
         super(Snake, self).__init__() # Initialize an Env class from gym.
 
         self.state_definition_type = config['params']['state_definition_type']
+        # Every instance can play on its own board size.
+        self.WIDTH, self.HEIGHT = get_board_size(config['params'])
         self.human = config['human']
         self.save_for_gif = config['save_for_gif']
-        self.eps_dir = config.get('eps_dir')
+        self.frames_dir = config.get('frames_dir')
         self.step_number = 0
         self.episode_number = 0
         self.done = False # whether or not the game is over
+        self.won = False # whether the snake filled the whole board
         self.action_space = 4 # The dimension of the action space is 4.
-        self.state_space = 12 # Our state/observation space is 12-dimensional.
+        # The state space is 12-dimensional, except for 'grid' observations,
+        # which are stored as obs_size bytes of bit-packed board cells.
+        self.state_space, self.obs_size, self.obs_dtype =\
+            get_observation_spec(self.state_definition_type, self.WIDTH, self.HEIGHT)
         self.reward=0
         self.total=0
         self.maximum=0
-
-        # Create the background Screen in which the snake hunts for the apple.
-        self.win = turtle.Screen()
-        self.win.title(self.GAME_TITLE)
-        self.win.bgcolor(*self.BG_COLOR)
-        self.win.tracer(0)
-        # +32 is an eyeballed frame adjustment.
-        self.win.setup(width=self.PIXEL_W+32, height=self.PIXEL_H+32)
-
-        # Create the snake itself as a head and an (invisible) dummy body chunk.
-        self.head = turtle.Turtle()
-        self.head.shape(self.SNAKE_SHAPE)
-        # The default turtlesize of (1.0, 1.0, 1.0) means 20-pixels width,
-        # 20-pixels height, and 1-width for the shape's outline.
-        head_size = tuple(self.HEAD_SIZE*num/20 for num in self.head.turtlesize())
-        self.head.turtlesize(*head_size)
-        self.head.speed(self.SNAKE_SPEED)
-        self.head.penup() # Pull the pen up -- no drawing when moving.
-        self.head.color(self.SNAKE_COLOR)
-        self.head.goto(self.SNAKE_START_X, self.SNAKE_START_Y)
+        self.seed(config['params'].get('seed'))
+        self.timer = NULL_TIMER # A PhaseTimer can be swapped in to time step().
+
+        # The head may stand anywhere from -X_MAX to X_MAX (and -Y_MAX to
+        # Y_MAX); stepping past either edge means hitting a wall.
+        self.x_max = self.WIDTH//2
+        self.y_max = self.HEIGHT//2
+        # The occupancy grid counts the body chunks covering each cell. It has
+        # a two-cell border of WALL cells so that a head that just left the
+        # board (and its neighbors) can still be looked up, and every cell is
+        # addressed by its flat index into the grid, so a move is just an
+        # integer offset.
+        self.grid_w = 2*self.x_max + 5
+        self.grid_h = 2*self.y_max + 5
+        self.grid = np.full((self.grid_h, self.grid_w), self.WALL, dtype=np.int8)
+        self.grid[2:-2, 2:-2] = 0
+        self.empty_grid = self.grid.copy()
+        self.occupancy = self.grid.ravel() # a flat view of the same memory
+        self.board = self.grid[2:-2, 2:-2] # a view of the board without its border
+        # Every cell on the board is kept in free_cells, with the cells that no
+        # body chunk covers packed into its first num_free entries. free_index
+        # maps a cell back to its entry, so a cell moves in or out of the free
+        # part with one swap and a random free cell is a single random index.
+        self.free_cells = np.flatnonzero(self.occupancy == 0).tolist()
+        self.free_index = [len(self.occupancy)]*len(self.occupancy) # walls are never free
+        for i, cell in enumerate(self.free_cells):
+            self.free_index[cell] = i
+        self.num_free = len(self.free_cells)
+        # how one step in each direction changes the head's flat cell index
+        self.moves = {'up':self.grid_w, 'down':-self.grid_w, 'left':-1,
+                      'right':1, 'stop':0}
+        self.neighbors = [self.grid_w, -self.grid_w, -1, 1] # above, below, left, right
+        # Observations are written from tables built once per board size by
+        # the encoder registered for the state definition (unknown state
+        # definitions fall back to 'default').
+        self.tables = get_feature_tables(self.WIDTH, self.HEIGHT)
+        self.encode_state = STATE_ENCODERS.get(self.state_definition_type,
+                                               STATE_ENCODERS['default'])
+        if self.state_definition_type == 'grid': # the body, head, and apple planes
+            self.planes = np.zeros((3, *self.board.shape), dtype=bool)
+
+        # Create the snake itself as a head and a body of grid cells.
+        self.head_cell = self.to_cell(self.SNAKE_START_X, self.SNAKE_START_Y)
         # The possible directions are 'up', 'right', 'down', 'left', or 'stop'.
-        self.head.direction = 'stop'
-        # The snake body is a list of turtle objects that increments as it eats.
-        self.body = []
-        # The dummy body chunk makes tracking how the body moves a bit easier.
-        self.append_body_chunk()
+        self.direction = 'stop'
+        # The body is a deque of cells that grows as the snake eats. The 0th
+        # chunk always sits under the head, and the last one is the tail.
+        self.body = deque()
 
         # Create the apple that the snake should hunt.
-        self.apple = turtle.Turtle()
-        self.apple.shape(self.APPLE_SHAPE)
-        self.apple.color(self.APPLE_COLOR)
-        apple_size = tuple(self.HEAD_SIZE*num/20 for num in self.apple.turtlesize())
-        self.apple.turtlesize(*apple_size)
-        self.apple.penup()
+        self.apple_cell = None
         self.spawn_apple(first=True)
 
         # Calculate the distance between the apple and the head of the snake.
-        self.dist = math.sqrt((self.head.xcor()-self.apple.xcor())**2\
-            + (self.head.ycor()-self.apple.ycor())**2)
-
-        # Create a text scoreboard that will update with information.
-        self.score = turtle.Turtle()
-        self.score.color('black')
-        self.score.penup()
-        self.score.hideturtle()
-        self.score.goto(0, int(0.75*self.PIXEL_H/2))
-        self.score.write(f'Total: {self.total}\tBest: {self.maximum}',
-                         align=self.FONT_ALIGN,
-                         font=(self.FONT_FAM, self.FONT_SIZE, self.FONT_STYLE))
-
-        # Define user controls.
-        # win.listen collects key events from TurtleScreen.
-        self.win.listen()
-        self.win.onkeypress(self.move_up, 'Up')
-        self.win.onkeypress(self.move_down, 'Down')
-        self.win.onkeypress(self.move_left, 'Left')
-        self.win.onkeypress(self.move_right, 'Right')
+        self.dist = math.dist(self.head, self.apple)
+
+        # Turtle graphics are only needed to show the game to a human. Frames
+        # for a gif are rasterized straight from the occupancy grid instead.
+        self.renderer = None
+        if self.human:
+            from renderer import TurtleRenderer
+            self.renderer = TurtleRenderer(self)
+            self.render()
+        # Episodes are only logged when asked for, since every reset then
+        # reseeds the RNG so that the episode can be replayed exactly.
+        self.trajectory = None
+        if config.get('record_trajectories'):
+            from trajectory import TrajectoryWriter
+            self.trajectory = TrajectoryWriter(
+                config.get('trajectory_dir', Path.cwd()/'trajectories'), self,
+                record_observations=config.get('record_observations', False))
+        self.recorder = None
+        if self.save_for_gif:
+            from recorder import FrameRecorder
+            self.recorder = FrameRecorder(
+                self.frames_dir if self.frames_dir else Path.cwd()/'frames',
+                self.WIDTH, self.HEIGHT,
+                record_every=config.get('record_every', 1),
+                episodes=config.get('record_episodes'))
+
+    def seed(self, seed=None):
+        '''
+        seeds the random number generator that places the apple
+        '''
+        self.rng = random.Random(seed)
+        return [seed]
+
+    def to_cell(self, x, y):
+        '''
+        converts (x, y) coordinates into a flat index of the occupancy grid
+        '''
+        return (y + self.y_max + 2)*self.grid_w + x + self.x_max + 2
+
+    def to_coords(self, cell):
+        '''
+        converts a flat index of the occupancy grid into (x, y) coordinates
+        '''
+        row, col = divmod(cell, self.grid_w)
+        return col - self.x_max - 2, row - self.y_max - 2
+
+    @property
+    def head(self):
+        return self.to_coords(self.head_cell)
+
+    @property
+    def apple(self):
+        return self.to_coords(self.apple_cell)
 
     def move_head(self):
         '''
         changes the snake head's position according to its current direction
         '''
-        if self.head.direction == 'up':
-            y = self.head.ycor()
-            # Remember that sety and setx are measured in pixels.
-            self.head.sety(y + self.HEAD_SIZE)
-        elif self.head.direction == 'down':
-            y = self.head.ycor()
-            self.head.sety(y - self.HEAD_SIZE)
-        elif self.head.direction == 'left':
-            x = self.head.xcor()
-            self.head.setx(x - self.HEAD_SIZE)
-        elif self.head.direction == 'right':
-            x = self.head.xcor()
-            self.head.setx(x + self.HEAD_SIZE)
-        else: # This means self.head.direction == 'stop', so reset the reward.
+        if self.direction == 'stop': # Reset the reward while standing still.
             self.reward = 0
+        self.head_cell += self.moves[self.direction]
 
-    def move_body(self):
+    def move_body(self, grow=False):
         '''
         moves the snakes body, following the head's lead
         '''
-        # The 0th index is the dummy body chunk and NOT the snake's head.
-        for i, chunk in reversed(list(enumerate(self.body))): # 10, 9, 8, 7, ...
-            if i != 0:
-                x = self.body[i-1].xcor()
-                y = self.body[i-1].ycor()
-                self.body[i].goto(x, y)
-            else:
-                self.body[i].goto(self.head.xcor(), self.head.ycor())
+        # Every chunk takes the place of the one in front of it, which is the
+        # same as dropping the tail and pushing the new head position. A snake
+        # that just ate keeps its tail, so it grows by one chunk.
+        if not self.body and not grow:
+            return
+        if not grow:
+            tail = self.body.pop()
+            if self.occupancy[tail] != self.WALL:
+                self.occupancy[tail] -= 1
+                if self.occupancy[tail] == 0:
+                    self.vacate(tail)
+        self.body.appendleft(self.head_cell)
+        if self.occupancy[self.head_cell] != self.WALL:
+            if self.occupancy[self.head_cell] == 0:
+                self.occupy(self.head_cell)
+            self.occupancy[self.head_cell] += 1
+
+    def swap_free_cells(self, i, j):
+        '''
+        swaps two entries of the free cell array
+        '''
+        cell_i, cell_j = self.free_cells[i], self.free_cells[j]
+        self.free_cells[i], self.free_cells[j] = cell_j, cell_i
+        self.free_index[cell_j], self.free_index[cell_i] = i, j
+
+    def occupy(self, cell):
+        '''
+        moves a cell out of the free part of the free cell array
+        '''
+        self.num_free -= 1
+        self.swap_free_cells(self.free_index[cell], self.num_free)
+
+    def vacate(self, cell):
+        '''
+        moves a cell into the free part of the free cell array
+        '''
+        self.swap_free_cells(self.free_index[cell], self.num_free)
+        self.num_free += 1
 
     def move_up(self):
-        self.head.direction = 'up' if self.head.direction != 'down'\
-            else self.head.direction
+        self.direction = 'up' if self.direction != 'down'\
+            else self.direction
     def move_down(self):
-        self.head.direction = 'down' if self.head.direction != 'up'\
-            else self.head.direction
+        self.direction = 'down' if self.direction != 'up'\
+            else self.direction
     def move_left(self):
-        self.head.direction = 'left' if self.head.direction != 'right'\
-            else self.head.direction
+        self.direction = 'left' if self.direction != 'right'\
+            else self.direction
     def move_right(self):
-        self.head.direction = 'right' if self.head.direction != 'left'\
-            else self.head.direction
-
-    def append_body_chunk(self):
-        '''
-        appends a chunk to elongate the snake's body after it successfully eats
-        an apple
-        '''
-        chunk = turtle.Turtle()
-        chunk.speed(self.SNAKE_SPEED)
-        chunk.shape(self.SNAKE_SHAPE)
-        # Scale the body chunks to be 80% as large as the head.
-        body_size = tuple(0.8*self.HEAD_SIZE*num/20 for num in self.head.turtlesize())
-        chunk.turtlesize(*body_size)
-        chunk.color(self.SNAKE_COLOR)
-        chunk.penup()
-        # Add additional turtles of the same shape to a running list.
-        self.body.append(chunk)
+        self.direction = 'right' if self.direction != 'left'\
+            else self.direction
 
     def update_score(self):
         '''
-        increments and updates the scoreboard
+        increments the score
         '''
         self.total += 1
         self.maximum = self.total if self.total>= self.maximum else self.maximum
-        self.score.clear()
-        self.score.write(f"Total: {self.total}\tBest: {self.maximum}",
-                         align=self.FONT_ALIGN,
-                         font=(self.FONT_FAM, self.FONT_SIZE, self.FONT_STYLE))
 
-    def get_random_coordinates(self):
+    def sample_free_cell(self):
         '''
-        returns coordinates in units of HEAD_SIZE
+        returns a random cell that neither the head nor the body covers, or
+        None if there are none left
         '''
-        x = random.randint(-self.WIDTH/2, self.WIDTH/2)
-        y = random.randint(-self.HEIGHT/2, self.HEIGHT/2)
-        return x, y
+        # The head isn't part of the body until the snake first eats, so set
+        # its cell aside while sampling.
+        head_is_free = self.free_index[self.head_cell] < self.num_free
+        if head_is_free:
+            self.occupy(self.head_cell)
+        cell = self.free_cells[self.rng.randrange(self.num_free)]\
+            if self.num_free else None
+        if head_is_free:
+            self.vacate(self.head_cell)
+        return cell
 
     def spawn_apple(self, first=False):
         '''
         spawns the apple at a random location on the screen that is not inside
-        the snake
-        '''
-        while True:
-            self.apple.x, self.apple.y = self.get_random_coordinates()
-            self.apple.goto(round(self.apple.x*self.HEAD_SIZE),
-                            round(self.apple.y*self.HEAD_SIZE))
-            # Make sure the apple doesn't spawn in the snake itself.
-            if not self.is_eating_apple():
-                break
+        the snake and returns whether there was any room left for it
+        '''
         if not first:
             self.update_score()
-            self.append_body_chunk()
+        cell = self.sample_free_cell()
+        if cell is None: # The snake fills the whole board.
+            return False
+        self.apple_cell = cell
         return True
 
     def reset_score(self):
         '''
-        resets the scoreboard (keeping the best score)
+        resets the score (keeping the best score)
         '''
-        self.score.clear()
         self.total = 0
-        self.score.write(f"Total: {self.total}\tBest: {self.maximum}",
-                         align=self.FONT_ALIGN,
-                         font=(self.FONT_FAM, self.FONT_SIZE, self.FONT_STYLE))
 
     def get_distance_to_apple(self):
         '''
         calculates the straight-line distance from the snake's head to the apple
         '''
         self.prev_dist = self.dist
-        self.dist = math.sqrt((self.head.xcor()-self.apple.xcor())**2 +\
-            (self.head.ycor()-self.apple.ycor())**2)
+        self.dist = math.dist(self.head, self.apple)
 
     def is_eating_body(self):
         '''
         checks to see if the snake is eating its body
         '''
-        # [o][o]
-        # [o][<] You need a length of at leaset 4 to eat yourself.
-        if any([body.distance(self.head) < self.HEAD_SIZE for\
-            body in self.body[3:]]):
+        # The 0th body chunk is always under the head, so a second chunk in the
+        # head's cell means the snake ran into itself. The neck and the chunk
+        # behind it can never be there, so this needs a length of at least 4.
+        if self.occupancy[self.head_cell] > 1:
             self.reset_score()
             return True
 
-    def is_eating_apple(self):
-        '''
-        checks to see if the snake is eating an apple
-        '''
-        if len(self.body)>0:
-            if any([chunk.distance(self.apple) < self.HEAD_SIZE for\
-                chunk in self.body]):
-                return True
-        if self.head.distance(self.apple) < self.HEAD_SIZE:
-            return True
-
     def is_hitting_wall(self):
         '''
         checks to see if the snake is hitting a wall
         '''
-        if any([self.head.xcor() >  self.PIXEL_W/2,
-                self.head.xcor() < -self.PIXEL_W/2,
-                self.head.ycor() >  self.PIXEL_H/2,
-                self.head.ycor() < -self.PIXEL_H/2]):
+        if self.occupancy[self.head_cell] == self.WALL:
             self.reset_score()
             return True
 
-    def reset(self):
+    def is_body_adjacent(self, cell):
+        '''
+        checks to see if a body chunk other than the neck occupies a cell
+        '''
+        if self.occupancy[cell] <= 0: # empty or a wall
+            return False
+        # The neck always trails the head, so it never counts as an obstacle.
+        return len(self.body) < 2 or cell != self.body[1]
+
+    def reset(self, out=None, seed=None, apple=None):
         '''
         Resets the environment to an initial state and returns an initial
         observation.
@@ -262,29 +300,66 @@ class Snake(gym.Env):
         words, each call of `reset()` should yield an environment suitable for
         a new episode, independent of previous episodes.
 
+        Args:
+            out (array): an optional float32 buffer to write the observation to
+            seed (int): an optional seed for the RNG, which also makes the
+                        episode independent of the one before it
+            apple (tuple): optional (x, y) coordinates to move the apple to
+
         Returns:
             observation (object): the initial observation.
         '''
         if self.human:
             time.sleep(1)
-        for chunk in self.body: # Hide the body.
-            chunk.hideturtle()
-        self.body = []
-        self.head.goto(self.SNAKE_START_X, self.SNAKE_START_Y)
+        self.body.clear()
+        self.grid[:] = self.empty_grid
+        self.head_cell = self.to_cell(self.SNAKE_START_X, self.SNAKE_START_Y)
         # Reinitialize the starting direction in pause mode.
-        self.head.direction = 'stop'
+        self.direction = 'stop'
         self.reward=self.total=0
-        self.done = False
-        return self.get_state()
+        self.done = self.won = False
+        self.num_free = len(self.free_cells) # The board is empty again.
+        if self.trajectory is not None:
+            self.trajectory.end_episode()
+            # Every logged episode gets its own seed, drawn from the RNG.
+            seed = self.rng.getrandbits(64) if seed is None else seed
+        if apple is not None:
+            self.apple_cell = self.to_cell(*apple)
+        if seed is not None:
+            self.seed(seed)
+            # The first step's reward compares against this distance, which
+            # would otherwise be left over from the last episode.
+            self.dist = math.dist(self.head, self.apple)
+        state = self.get_state(out)
+        if self.trajectory is not None:
+            self.trajectory.begin_episode(seed, self.apple, state)
+        return state
 
-    def save_eps(self):
+    def render(self, mode='human'):
         '''
-        saves the current frame as an eps file
+        draws the current frame if a renderer is attached
         '''
-        eps_fname = f'ep{self.episode_number:09d}-stp{self.step_number:09d}.eps'
-        eps_outpath = self.eps_dir/eps_fname if isinstance(self.eps_dir, Path)\
-            else eps_fname
-        turtle.getcanvas().postscript(file=eps_outpath, colormode='color')
+        if self.renderer is None:
+            return
+        try:
+            self.renderer.draw()
+        except: # If we throw an error while exiting, just exit.
+            sys.exit()
+
+    def save_frame(self):
+        '''
+        rasterizes the current frame into the frame store for gif creation
+        '''
+        self.recorder.record(self)
+
+    def close(self):
+        '''
+        writes out any frames and episodes that are still waiting in memory
+        '''
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.trajectory is not None:
+            self.trajectory.close()
 
     def run_game(self):
         '''
@@ -292,19 +367,21 @@ class Snake(gym.Env):
         '''
         # Flip this to True if the snake gains a reward during a time step.
         reward_given = False
-        try:
-            self.win.update()
-            self.move_head()
-            if self.head.distance(self.apple) < self.HEAD_SIZE:
-                # If we munched an apple, respawn the apple at a new location.
-                self.spawn_apple()
-                self.reward = 10
-                reward_given = True
-            self.move_body() # After the snake head moves, update the body.
-            self.get_distance_to_apple()
-        except: # If we throw an error while exiting, just exit.
-            sys.exit()
-
+        start = self.timer.now()
+        self.move_head()
+        ate = self.head_cell == self.apple_cell
+        if ate:
+            self.reward = 10
+            reward_given = True
+        self.move_body(grow=ate) # After the snake head moves, update the body.
+        if ate: # If we munched an apple, respawn the apple at a new location.
+            if not self.spawn_apple():
+                # There's nowhere left for an apple, so the snake has won.
+                self.won = self.done = True
+        self.get_distance_to_apple()
+        self.timer.add('env.step/move', start)
+
+        start = self.timer.now()
         if self.is_eating_body(): # Check to see if the snake is eating itself.
             self.reward = -100 # Disincentivize eating yourself.
             reward_given = self.done = True
@@ -315,14 +392,21 @@ class Snake(gym.Env):
             reward_given = self.done = True
             if self.human:
                 self.reset()
+        if self.won and self.human:
+            self.reset()
         if not reward_given:
             self.reward=1 if self.dist < self.prev_dist else -1
+        self.timer.add('env.step/collision', start)
+
+        start = self.timer.now()
+        self.render()
         if self.human:
             time.sleep(self.SLEEP)
         if self.save_for_gif:
-            self.save_eps()
+            self.save_frame()
+        self.timer.add('env.step/render', start)
 
-    def step(self, action, episode_number=None, step_number=None):
+    def step(self, action, episode_number=None, step_number=None, out=None):
         '''
         Run one timestep of the environment's dynamics. When end of
         episode is reached, you are responsible for calling `reset()`
@@ -332,6 +416,7 @@ class Snake(gym.Env):
 
         Args:
             action (object): an action provided by the agent
+            out (array): an optional float32 buffer to write the observation to
 
         Returns:
             observation (object): agent's observation of the current environment
@@ -339,9 +424,11 @@ class Snake(gym.Env):
             done (bool): whether the episode has ended, in which case further
                          step() calls will return undefined results
             info (dict): contains auxiliary diagnostic information (helpful for
-                         debugging, and sometimes learning)
+                         debugging, and sometimes learning), e.g. whether the
+                         snake 'won' by filling the board
 
         '''
+        step_start = self.timer.now()
         if action == 0: self.move_up()
         if action == 1: self.move_down()
         if action == 2: self.move_left()
@@ -352,87 +439,429 @@ class Snake(gym.Env):
         if isinstance(step_number, int):
             self.step_number = step_number
         self.run_game()
-        return self.get_state(), self.reward, self.done, {}
+        start = self.timer.now()
+        state = self.get_state(out)
+        self.timer.add('env.step/state', start)
+        if self.trajectory is not None:
+            self.trajectory.record_step(action, self.reward, state, self.done)
+        self.timer.add('env.step', step_start)
+        return state, self.reward, self.done, {'won':self.won}
+
+    def get_state(self, out=None):
+        '''
+        obtains the state of the snake as an array of obs_size elements (12
+        float32 features, or packed uint8 bits for 'grid'), writing it into
+        `out` (any array of that size and dtype) if given
+        '''
+        if out is None:
+            out = np.empty(self.obs_size, dtype=self.obs_dtype)
+        self.encode_state(self, out.reshape(self.obs_size))
+        return out
+
+    def apple_flags(self):
+        '''
+        looks up which directions point from the head toward the apple
+        '''
+        head_x, head_y = self.tables.x[self.head_cell], self.tables.y[self.head_cell]
+        apple_x, apple_y = self.tables.x[self.apple_cell], self.tables.y[self.apple_cell]
+        return APPLE_FLAGS[(apple_y > head_y) - (apple_y < head_y) + 1,
+                           (apple_x > head_x) - (apple_x < head_x) + 1]
 
-    def get_state(self):
+    def write_obstacle_flags(self, out):
         '''
-        obtains the 12-dimensional state of the snake
+        writes whether a wall OR a body chunk is adjacent to the head (above,
+        below, left, right) into a 4-element buffer
         '''
-        # Define the coordinates of the snake head in units of HEAD_SIZE.
-        self.head.x = self.head.xcor()/self.WIDTH
-        self.head.y = self.head.ycor()/self.HEIGHT
+        out[:] = self.tables.walls[self.head_cell]
+        # Check to see if the snake's body chunks are adjacent to the head.
+        # Here are some example states where ^ is the head and . is the tail:
+        #   [0][1][0]     [.][1][0]       [^]
+        #   [1][^][1]        [^][1]       [0]
+        #   [.][1][0]        [1][0]       [.]
+        # A head that just left the board is next to the WALL border, and
+        # every lookup here is a single read of the occupancy grid.
+        for i, offset in enumerate(self.neighbors):
+            if self.is_body_adjacent(self.head_cell + offset):
+                out[i] = 1
 
-        # Scale the coordinates of the snake head range from 0 to 1.
-        # This requires shifting the origin to the left by half the width of the 1-length x-interval,
+STATE_ENCODERS = {} # functions that write each state_definition_type's observation
+
+def register_state_encoder(name):
+    '''
+    registers a function that writes the observation of a Snake for one
+    state_definition_type into a buffer of obs_size elements
+    '''
+    def register(encoder):
+        STATE_ENCODERS[name] = encoder
+        return encoder
+    return register
+
+# APPLE_FLAGS[sign(dy)+1, sign(dx)+1] holds (above, below, left, right) for an
+# apple that lies (dx, dy) away from the head.
+APPLE_FLAGS = np.array([[[0, 1, 0, 1], [0, 1, 0, 0], [0, 1, 1, 0]],
+                        [[0, 0, 0, 1], [0, 0, 0, 0], [0, 0, 1, 0]],
+                        [[1, 0, 0, 1], [1, 0, 0, 0], [1, 0, 1, 0]]], dtype=np.float32)
+# one-hot encodings of the head's direction (up, down, left, right)
+DIRECTION_FLAGS = {'up':np.array([1, 0, 0, 0], dtype=np.float32),
+                   'down':np.array([0, 1, 0, 0], dtype=np.float32),
+                   'left':np.array([0, 0, 1, 0], dtype=np.float32),
+                   'right':np.array([0, 0, 0, 1], dtype=np.float32),
+                   'stop':np.zeros(4, dtype=np.float32)}
+
+class FeatureTables:
+    '''
+    per-cell lookup tables for building observations on one board size, indexed
+    by the flat cell indices of Snake's padded occupancy grid
+    '''
+    def __init__(self, width, height):
+        x_max, y_max = width//2, height//2
+        grid_w, grid_h = 2*x_max + 5, 2*y_max + 5
+        rows, cols = np.divmod(np.arange(grid_w*grid_h), grid_w)
+        x, y = cols - x_max - 2, rows - y_max - 2
+        # Plain lists make single-cell coordinate lookups as cheap as possible.
+        self.x, self.y = x.tolist(), y.tolist()
+
+        # Scale the coordinates to range from 0 to 1. This requires shifting
+        # the origin to the left by half the width of the 1-length x-interval,
         # and also shifting down by half the height of the 1-length y-interval.
-        self.head.xsc = self.head.x/self.WIDTH+0.5
-        self.head.ysc = self.head.y/self.HEIGHT+0.5
+        self.scaled = np.stack([x/width + 0.5, y/height + 0.5], axis=1).astype(np.float32)
 
-        # Scale the coordinates of the apple to [0,1].
-        self.apple.xsc = self.apple.x/self.WIDTH+0.5
-        self.apple.ysc = self.apple.y/self.HEIGHT+0.5
+        # Check to if a cell is adjacent to a wall and in what direction.
+        above = ( height/2 - 1 <= y) & (y <=  height/2)     # within one head unit below the top wall
+        below = (-height/2     <= y) & (y <= -height/2 + 1) # within one head unit above the bottom wall
+        left  = (-width /2     <= x) & (x <= -width /2 + 1) # within one head unit to the right of the left wall
+        right = ( width /2 - 1 <= x) & (x <=  width /2)     # within one head unit to the left of the right wall
+        self.walls = np.stack([above, below, left, right], axis=1).astype(np.float32)
+        self.walls_clockwise = np.ascontiguousarray(self.walls[:, [0, 3, 1, 2]])
+
+def get_board_size(params):
+    '''
+    reads the board's (width, height) from params['board_size'], which is
+    either one side length or a [width, height] pair
+    '''
+    size = params.get('board_size', Snake.WIDTH)
+    if isinstance(size, int):
+        return size, size
+    width, height = size
+    return int(width), int(height)
+
+def get_observation_spec(state_definition_type, width, height):
+    '''
+    returns (state_space, obs_size, obs_dtype): how many features the agent
+    sees, and how many elements of which dtype store one observation
+    '''
+    if state_definition_type == 'grid':
+        # One bit per cell in each of three planes, packed 8 bits to a byte.
+        num_bits = 3*(2*(width//2) + 1)*(2*(height//2) + 1)
+        return num_bits, (num_bits + 7)//8, np.uint8
+    return 12, 12, np.float32
+
+@lru_cache(maxsize=None)
+def get_feature_tables(width, height):
+    '''
+    builds the lookup tables for a board size once and then reuses them
+    '''
+    return FeatureTables(width, height)
+
+# The 'default' state includes apple direction, obstacle adjacency, and head
+# direction information.
+@register_state_encoder('default')
+def encode_default(env, out):
+    out[0:4] = env.apple_flags()
+    env.write_obstacle_flags(out[4:8])
+    out[8:12] = DIRECTION_FLAGS[env.direction]
+
+# Let the agent get direct knowledge of where the apple and head are.
+@register_state_encoder('apple_coords')
+def encode_apple_coords(env, out):
+    out[0:2] = env.tables.scaled[env.apple_cell]
+    out[2:4] = env.tables.scaled[env.head_cell]
+    env.write_obstacle_flags(out[4:8])
+    out[8:12] = DIRECTION_FLAGS[env.direction]
+
+# Don't let the agent know the direction in which the head is moving.
+@register_state_encoder('no_dir')
+def encode_no_dir(env, out):
+    out[0:4] = env.apple_flags()
+    env.write_obstacle_flags(out[4:8])
+    out[8:12] = 0
+
+# Remove body chunks from the definition of the obstacle substates.
+@register_state_encoder('no_body')
+def encode_no_body(env, out):
+    out[0:4] = env.apple_flags()
+    out[4:8] = env.tables.walls_clockwise[env.head_cell] # above, right, below, left
+    out[8:12] = DIRECTION_FLAGS[env.direction]
+
+# Show the agent the whole board as three planes of bits marking the body, the
+# head, and the apple. The planes are packed 8 cells to a byte, so a stored
+# observation takes 3 bits per cell rather than 3 float32 features (12 bytes).
+@register_state_encoder('grid')
+def encode_grid(env, out):
+    planes = env.planes
+    np.greater(env.board, 0, out=planes[0]) # read straight from the grid's memory
+    planes[1:] = False
+    for plane, cell in ((1, env.head_cell), (2, env.apple_cell)):
+        x, y = env.tables.x[cell], env.tables.y[cell]
+        if abs(x) <= env.x_max and abs(y) <= env.y_max: # A crashed head is off the board.
+            planes[plane, y + env.y_max, x + env.x_max] = True
+    out[:] = np.packbits(planes, axis=None)
+
+class SnakeVecEnv:
+    '''
+    a batch of independent Snake games that all advance in one NumPy step
+    '''
+    SNAKE_START_X = Snake.SNAKE_START_X
+    SNAKE_START_Y = Snake.SNAKE_START_Y
+    # Directions share their codes with the actions (0:up 1:down 2:left
+    # 3:right), and 4 means the snake is standing still after a reset.
+    STOP = 4
+    MOVES = np.array([[0, 1], [0, -1], [-1, 0], [1, 0], [0, 0]])
+    OPPOSITES = np.array([1, 0, 3, 2, -1])
+
+    def __init__(self, config, num_envs=None, seed=None):
+        params = config['params']
+        self.state_definition_type = params['state_definition_type']
+        self.num_envs = num_envs if num_envs else params.get('num_envs', 1)
+        self.max_steps = params.get('max_steps') # Games past this are reset.
+        self.rng = np.random.default_rng(seed if seed is not None else params.get('seed'))
+        self.WIDTH, self.HEIGHT = get_board_size(params)
+        self.action_space = 4
+        self.state_space, self.obs_size, self.obs_dtype =\
+            get_observation_spec(self.state_definition_type, self.WIDTH, self.HEIGHT)
+
+        n = self.num_envs
+        self.rows = 2*(self.HEIGHT//2) + 1
+        self.cols = 2*(self.WIDTH//2) + 1
+        self.x_max = self.WIDTH//2
+        self.y_max = self.HEIGHT//2
+        # The longest possible snake covers every cell of the board.
+        self.capacity = self.rows*self.cols
+        self.arange = np.arange(n)
+
+        self.heads = np.zeros((n, 2), dtype=np.int64)
+        self.directions = np.full(n, self.STOP, dtype=np.int64)
+        self.apples = np.zeros((n, 2), dtype=np.int64)
+        # Each body is a ring buffer of (x, y) cells. The 0th chunk sits at
+        # body_start and the ith chunk at (body_start + i) % capacity.
+        self.bodies = np.zeros((n, self.capacity, 2), dtype=np.int64)
+        self.body_start = np.zeros(n, dtype=np.int64)
+        self.lengths = np.zeros(n, dtype=np.int64)
+        # The occupancy grids count body chunks per cell as [y + y_max, x + x_max].
+        self.occupancy = np.zeros((n, self.rows, self.cols), dtype=np.int8)
+        self.dist = np.zeros(n)
+        self.totals = np.zeros(n, dtype=np.int64)
+        self.maxima = np.zeros(n, dtype=np.int64)
+        self.steps = np.zeros(n, dtype=np.int64)
+
+        self.reset_games(self.arange)
+        self.spawn_apples(self.arange)
+        self.dist = self.distance_to_apples()
+
+    def reset_games(self, games):
+        '''
+        puts the chosen games back at their initial state (the apple stays)
+        '''
+        self.occupancy[games] = 0
+        self.heads[games] = (self.SNAKE_START_X, self.SNAKE_START_Y)
+        self.directions[games] = self.STOP
+        self.body_start[games] = 0
+        self.lengths[games] = 0
+        self.totals[games] = 0
+        self.steps[games] = 0
+
+    def reset(self):
+        '''
+        resets every game and returns an (N, obs_size) array of initial observations
+        '''
+        self.reset_games(self.arange)
+        return self.get_states()
+
+    def close(self):
+        '''
+        releases the environment (there is nothing to clean up in-process)
+        '''
+
+    def in_bounds(self, cells):
+        '''
+        checks which (x, y) cells of an (..., 2) array lie inside the walls
+        '''
+        return (np.abs(cells[..., 0]) <= self.x_max)\
+            & (np.abs(cells[..., 1]) <= self.y_max)
+
+    def occupied(self, games, cells):
+        '''
+        reads the occupancy of one cell per game, treating walls as empty
+        '''
+        inside = self.in_bounds(cells)
+        rows = np.clip(cells[:, 1] + self.y_max, 0, self.rows - 1)
+        cols = np.clip(cells[:, 0] + self.x_max, 0, self.cols - 1)
+        return np.where(inside, self.occupancy[games, rows, cols], 0)
+
+    def spawn_apples(self, games):
+        '''
+        spawns an apple at a uniformly random free cell in each chosen game
+        '''
+        if len(games) == 0:
+            return np.zeros(0, dtype=bool)
+        # Ranking uniform noise over only the free cells picks one of them
+        # uniformly at random for every game at once.
+        free = (self.occupancy[games] == 0).reshape(len(games), -1)
+        noise = self.rng.random(free.shape)
+        noise[~free] = -1
+        cells = np.argmax(noise, axis=1)
+        self.apples[games, 0] = cells % self.cols - self.x_max
+        self.apples[games, 1] = cells // self.cols - self.y_max
+        return free.any(axis=1) # A full board has nowhere left for an apple.
+
+    def distance_to_apples(self):
+        '''
+        calculates the straight-line distance from each head to its apple
+        '''
+        return np.hypot(*(self.heads - self.apples).T)
+
+    def step(self, actions):
+        '''
+        Advances every game by one time step. Finished games are reset
+        automatically, so the returned observations for them already belong to
+        the next episode.
+
+        Args:
+            actions (array): one action per game
+
+        Returns:
+            observations (array): an (N, obs_size) array of next observations
+            rewards (array): the reward each game earned this step
+            dones (array): whether each game ended by hitting a wall or itself
+            info (dict): 'terminal_observation' holds the final observations of
+                         finished games, 'truncated' marks games that ran out
+                         of steps, and 'totals' holds each game's apple count
+        '''
+        actions = np.asarray(actions, dtype=np.int64)
+        n = self.arange
+        # A snake can't reverse into itself, so ignore opposite directions.
+        self.directions = np.where(self.OPPOSITES[actions] == self.directions,
+                                   self.directions, actions)
+        self.heads += self.MOVES[self.directions]
+        self.steps += 1
+        ate = np.all(self.heads == self.apples, axis=1)
+
+        # Drop the tail of every moving snake that didn't eat.
+        moving = (self.lengths > 0) | ate
+        shrink = moving & ~ate
+        tails = self.bodies[n, (self.body_start + self.lengths - 1) % self.capacity]
+        games = n[shrink]
+        self.occupancy[games, tails[shrink, 1] + self.y_max,
+                       tails[shrink, 0] + self.x_max] -= 1
+        # Push the new head position onto the front of every moving snake.
+        self.body_start = np.where(moving, (self.body_start - 1) % self.capacity,
+                                   self.body_start)
+        self.lengths += ate
+        games = n[moving]
+        self.bodies[games, self.body_start[games]] = self.heads[games]
+        inside = self.in_bounds(self.heads)
+        games = n[moving & inside]
+        self.occupancy[games, self.heads[games, 1] + self.y_max,
+                       self.heads[games, 0] + self.x_max] += 1
+
+        full = ~self.spawn_apples(n[ate])
+        self.totals += ate
+        self.maxima = np.maximum(self.maxima, self.totals)
+        prev_dist = self.dist
+        self.dist = self.distance_to_apples()
+
+        # The 0th chunk always sits under the head, so a second one means the
+        # snake ran into itself.
+        eating_body = self.occupied(n, self.heads) > 1
+        dones = eating_body | ~inside
+        rewards = np.where(self.dist < prev_dist, 1, -1)
+        rewards = np.where(ate, 10, rewards)
+        rewards = np.where(dones, -100, rewards)
+        # A snake that fills the whole board has won and ends its game too.
+        dones[n[ate][full]] = True
+
+        observations = self.get_states()
+        truncated = np.zeros(len(n), dtype=bool)
+        if self.max_steps:
+            truncated = ~dones & (self.steps >= self.max_steps)
+        info = {'totals':self.totals.copy(), 'truncated':truncated}
+        finished = n[dones | truncated]
+        if len(finished):
+            info['terminal_observation'] = observations[finished].copy()
+            self.reset_games(finished)
+            observations[finished] = self.get_states(finished)
+        return observations, rewards, dones, info
+
+    def get_states(self, games=None):
+        '''
+        obtains the state of the chosen (default: all) games
+        '''
+        games = self.arange if games is None else games
+        heads = self.heads[games]
+        apples = self.apples[games]
+        if self.state_definition_type == 'grid':
+            return self.get_grid_states(games, heads, apples)
+        directions = self.directions[games]
+        head_x, head_y = heads[:, 0], heads[:, 1]
+        apple_x, apple_y = apples[:, 0], apples[:, 1]
 
         # Check to see which directions point toward the apple.
-        apple_above=1 if self.head.y < self.apple.y else 0
-        apple_below=1 if self.head.y > self.apple.y else 0
-        apple_left =1 if self.head.x < self.apple.x else 0
-        apple_right=1 if self.head.x > self.apple.x else 0
+        apple_above = head_y < apple_y
+        apple_below = head_y > apple_y
+        apple_left  = head_x < apple_x
+        apple_right = head_x > apple_x
 
         # Check to if the head is adjacent to a wall and in what direction.
-        wall_above=1 if  self.HEIGHT/2 - 1 <= self.head.y and self.head.y <=  self.HEIGHT/2     else 0 # within one HEAD_SIZE unit below the top wall
-        wall_below=1 if -self.HEIGHT/2     <= self.head.y and self.head.y <= -self.HEIGHT/2 + 1 else 0 # within one HEAD_SIZE unit to the left of the right wall
-        wall_left =1 if -self.WIDTH /2     <= self.head.x and self.head.x <= -self.WIDTH /2 + 1 else 0 # within one HEAD_SIZE unit to the right of the left wall
-        wall_right=1 if  self.WIDTH /2 - 1 <= self.head.x and self.head.x <=  self.WIDTH /2     else 0 # within one HEAD_SIZE unit above the bottom wall
+        wall_above = ( self.HEIGHT/2 - 1 <= head_y) & (head_y <=  self.HEIGHT/2)
+        wall_below = (-self.HEIGHT/2     <= head_y) & (head_y <= -self.HEIGHT/2 + 1)
+        wall_left  = (-self.WIDTH /2     <= head_x) & (head_x <= -self.WIDTH /2 + 1)
+        wall_right = ( self.WIDTH /2 - 1 <= head_x) & (head_x <=  self.WIDTH /2)
+
+        # Check to see if body chunks other than the neck are next to the head.
+        necks = self.bodies[games, (self.body_start[games] + 1) % self.capacity]
+        has_neck = self.lengths[games] > 1
+        def body_at(dx, dy):
+            cells = heads + (dx, dy)
+            is_neck = has_neck & np.all(cells == necks, axis=1)
+            return (self.occupied(games, cells) > 0) & ~is_neck
+        obstacle_above = wall_above | body_at(0, 1)
+        obstacle_below = wall_below | body_at(0, -1)
+        obstacle_left  = wall_left  | body_at(-1, 0)
+        obstacle_right = wall_right | body_at(1, 0)
+
+        # One-hot encode the heads' directions (standing still is all zeros).
+        direction = np.zeros((len(games), 4), dtype=bool)
+        moving = directions != self.STOP
+        direction[np.arange(len(games))[moving], directions[moving]] = True
 
-        # Check to see if the snake's body chunks are adjacent to the head.
-        # Here are some example states where ^ is the head and . is the tail:
-        #   [0][1][0]     [.][1][0]       [^]
-        #   [1][^][1]        [^][1]       [0]
-        #   [.][1][0]        [1][0]       [.]
-        body_above=body_below=body_left=body_right=False
-        if len(self.body) > 3:
-            for chunk in self.body[3:]:
-                if chunk.distance(self.head) == self.HEAD_SIZE:
-                    if chunk.ycor() < self.head.ycor():
-                        body_below = True
-                    if chunk.ycor() > self.head.ycor():
-                        body_above = True
-                    if chunk.xcor() < self.head.xcor():
-                        body_left = True
-                    if chunk.xcor() > self.head.xcor():
-                        body_right = True
-
-        # Check to see if a wall OR a body chunk is adjacent to the head.
-        obstacle_above=1 if wall_above or body_above else 0
-        obstacle_below=1 if wall_below or body_below else 0
-        obstacle_left =1 if wall_left  or  body_left else 0
-        obstacle_right=1 if wall_right or body_right else 0
-
-        # One-hot encode the head's direction attribute.
-        direction_up   =1 if self.head.direction==   'up' else 0
-        direction_down =1 if self.head.direction== 'down' else 0
-        direction_left =1 if self.head.direction== 'left' else 0
-        direction_right=1 if self.head.direction=='right' else 0
-
-        # Let the agent get direct knowledge of where the apple and head are.
         if self.state_definition_type == 'apple_coords':
-            state = [self.apple.xsc, self.apple.ysc,  self.head.xsc,   self.head.ysc,
-                     obstacle_above, obstacle_below,  obstacle_left,  obstacle_right,
-                       direction_up, direction_down, direction_left, direction_right]
-         # Don't let the agent know the direction in which the head is moving.
+            columns = [apple_x/self.WIDTH+0.5, apple_y/self.HEIGHT+0.5,
+                       head_x/self.WIDTH+0.5, head_y/self.HEIGHT+0.5,
+                       obstacle_above, obstacle_below, obstacle_left, obstacle_right,
+                       *direction.T]
         elif self.state_definition_type == 'no_dir':
-            state = [   apple_above,    apple_below,     apple_left,     apple_right,
-                     obstacle_above, obstacle_below,  obstacle_left,  obstacle_right,
-                                  0,              0,              0,               0]
-        # Remove body chunks from the definition of the obstacle substates.
+            columns = [apple_above, apple_below, apple_left, apple_right,
+                       obstacle_above, obstacle_below, obstacle_left, obstacle_right,
+                       *np.zeros_like(direction).T]
         elif self.state_definition_type == 'no_body':
-            state = [   apple_above,    apple_below,     apple_left,     apple_right,
-                         wall_above,     wall_right,     wall_below,       wall_left,
-                       direction_up, direction_down, direction_left, direction_right]
-        # The 'default' state includes apple direction, obstacle adjacency, and
-        # head direction information.
+            columns = [apple_above, apple_below, apple_left, apple_right,
+                       wall_above, wall_right, wall_below, wall_left,
+                       *direction.T]
         else:
-            state = [   apple_above,    apple_below,     apple_left,     apple_right,
-                     obstacle_above, obstacle_below,  obstacle_left,  obstacle_right,
-                       direction_up, direction_down, direction_left, direction_right]
-        return state
+            columns = [apple_above, apple_below, apple_left, apple_right,
+                       obstacle_above, obstacle_below, obstacle_left, obstacle_right,
+                       *direction.T]
+        return np.stack(columns, axis=1).astype(np.float32)
+
+    def get_grid_states(self, games, heads, apples):
+        '''
+        packs the body, head, and apple planes of the chosen games into bits,
+        just like Snake's 'grid' observations
+        '''
+        planes = np.zeros((len(games), 3, self.rows, self.cols), dtype=bool)
+        planes[:, 0] = self.occupancy[games] > 0
+        for plane, cells in ((1, heads), (2, apples)):
+            inside = np.flatnonzero(self.in_bounds(cells))
+            planes[inside, plane, cells[inside, 1] + self.y_max,
+                   cells[inside, 0] + self.x_max] = True
+        return np.packbits(planes.reshape(len(games), -1), axis=1)
@@ -1,12 +1,28 @@
-from agent import train_dqn
-from environment import Snake
-from plotting import plot_history
-from gif_creator import GifBuilder
+from instrumentation import NULL_TIMER, PhaseTimer, EpisodeProfiler, measure_import_cost
+from checkpoint import Checkpointer
+from metrics import MetricsLog
+from environment import Snake, SnakeVecEnv
+from tabular import BINARY_STATE_DEFINITIONS
 from pathlib import Path
 from argparse import ArgumentParser
 from datetime import datetime
 import sys
 import json
+'''
+TensorFlow (agent.py's DQN with the Keras backend), matplotlib and pandas
+(plotting.py), and PIL (gif_creator.py) each take a while to import, so
+they're only imported by the code paths that use them. Human play never loads
+any of them, and the worker processes that re-import this module when they're
+spawned don't either. Run `python explore.py --import-cost` to see what every
+module costs to import.
+'''
+
+# the modules --import-cost reports on, from this script down to its heaviest
+# optional dependencies
+IMPORT_COST_MODULES = ['explore', 'environment', 'renderer', 'agent',
+                       'tabular', 'numpy_mlp', 'workers', 'metrics', 'plotting',
+                       'gif_creator', 'sweep', 'tensorflow', 'keras',
+                       'matplotlib.pyplot', 'pandas', 'PIL.Image']
 
 def parse_args():
     '''defines our CLI options'''
@@ -15,6 +31,21 @@ def parse_args():
     parser.add_argument('-c', '--config', dest='config', required=False,
                         default='config.json',
                         help='path to the configuration file')
+    parser.add_argument('-r', '--resume', dest='resume', required=False,
+                        nargs='?', const='latest',
+                        help='continue the run in this instance folder (or, '
+                             'with no folder, the latest run with a checkpoint) '
+                             'from its latest checkpoint')
+    parser.add_argument('-s', '--sweep', dest='sweep', required=False,
+                        choices=['grid', 'random'],
+                        help='run a grid or random search over the list-valued '
+                             'params in the config')
+    parser.add_argument('-n', '--trials', dest='trials', type=int, default=10,
+                        help='how many trials a random search runs')
+    parser.add_argument('-t', '--threads', dest='threads', type=int, default=1,
+                        help='how many CPU threads each sweep trial may use')
+    parser.add_argument('--import-cost', dest='import_cost', action='store_true',
+                        help='report how long each module takes to import and exit')
     return parser.parse_args()
 
 def get_config(path:str):
@@ -65,12 +96,82 @@ def check_config(config:dict):
                 sys.exit(1)
     return config
 
+def find_resume_dir(resume:str, figures_dir:Path):
+    '''
+    finds the instance folder of the run to resume
+    '''
+    if resume != 'latest':
+        return Path(resume)
+    latest = sorted(figures_dir.glob('*/checkpoints/latest'),
+                    key=lambda path: path.stat().st_mtime)
+    if not latest:
+        print(f'ERROR: no checkpoints found in {figures_dir}')
+        sys.exit(1)
+    return latest[-1].parent.parent
+
+def report_import_costs(modules=IMPORT_COST_MODULES):
+    '''
+    prints how long each module takes to import in a fresh interpreter, along
+    with the direct imports that cost it the most
+    '''
+    for module in modules:
+        seconds, children = measure_import_cost(module)
+        if seconds is None:
+            print(f'{module:<20} failed to import')
+            continue
+        heaviest = ', '.join(f'{name} {1000*cost:.0f}ms' for name, cost in children[:3])
+        print(f'{module:<20} {1000*seconds:>8.0f}ms  ({heaviest})')
+
+def sweep(args):
+    '''
+    runs every trial of a sweep config and summarizes them
+    '''
+    from plotting import plot_histories
+    from sweep import expand_trials, run_sweep, write_summary
+    config = get_config(path=args.config)
+    trials = expand_trials(config, args.sweep, args.trials)
+    for trial in trials: # Check every trial before any of them starts.
+        check_config(trial['config'])
+        if trial['config']['params'].get('num_workers', 1) > 1:
+            # Trials already run in worker processes of their own.
+            print('ERROR: sweep trials can\'t use num_workers; use num_envs instead')
+            sys.exit(1)
+    ts = datetime.now().strftime('%a%b%d-%H%M%S')
+    sweep_folder = f'sweep-{args.sweep}-{len(trials)}trials-{ts}'
+    name = config['name']
+    if isinstance(name, str) and name:
+        sweep_folder = f'{name}-{sweep_folder}'
+    sweep_dir = Path(config['project_root_dir'])/'figures'/sweep_folder
+    results = run_sweep(trials, sweep_dir, num_threads=args.threads)
+    write_summary(results, sweep_dir/'summary.csv')
+    if results:
+        labels = [f'{result["trial"]}: ' + ', '.join(
+            f'{key}={value}' for key, value in trials[result['trial']]['swept'].items())
+            for result in results]
+        num_episodes = min(len(result['history']) for result in results)
+        plot_histories([result['history'] for result in results], labels,
+                       outpath=sweep_dir/'learning-curves.png',
+                       window_len=max(int(num_episodes/5), 5))
+
 def main():
     args = parse_args()
+    if args.import_cost:
+        return report_import_costs()
+    if args.sweep:
+        return sweep(args)
     config = check_config(get_config(path=args.config))
-    params = config['params'] # the main parameters for the agent
     project_root_dir = Path(config['project_root_dir'])
     figures_dir = project_root_dir/'figures' # main folder for figures
+    resume_dir = None
+    if args.resume:
+        # A resumed run carries on with the config it was started with.
+        resume_dir = find_resume_dir(args.resume, figures_dir)
+        if not (resume_dir/'checkpoints'/'latest').exists():
+            print(f'ERROR: no checkpoint found in {resume_dir}')
+            sys.exit(1)
+        config = check_config(get_config(path=resume_dir/'config.json'))
+        figures_dir = resume_dir.parent
+    params = config['params'] # the main parameters for the agent
 
     # Name a folder to store the output of this run.
     ts = datetime.now().strftime('%a%b%d-%H%M%S')
@@ -82,32 +183,114 @@ def main():
     name = config['name']
     if isinstance(name, str) and name:
         instance_folder = f'{name}-{instance_folder}'
+    if resume_dir:
+        instance_folder = resume_dir.name
+    elif config.get('checkpoint_every') and not config['human']:
+        # Keep the config so that the run can be resumed with the same settings.
+        (figures_dir/instance_folder).mkdir(exist_ok=True, parents=True)
+        with open(figures_dir/instance_folder/'config.json', 'w') as json_file:
+            json.dump(config, json_file, indent=4)
 
     if config['save_for_gif']:
-        # If wanted, create folders to store the eps files for gif creation.
-        eps_dir = figures_dir/instance_folder/'gif-build'/'eps'
-        config['eps_dir'] = eps_dir
-        eps_dir.mkdir(exist_ok=True, parents=True)
+        # If wanted, create a folder to store the frames for gif creation.
+        frames_dir = figures_dir/instance_folder/'gif-build'/'frames'
+        config['frames_dir'] = frames_dir
+        frames_dir.mkdir(exist_ok=True, parents=True)
+
+    if config.get('record_trajectories'):
+        # Every episode is logged compactly so that it can be replayed later.
+        config['trajectory_dir'] = figures_dir/instance_folder/'trajectories'
 
-    env = Snake(config)
+    batched = params.get('num_envs', 1) > 1 or params.get('num_workers', 1) > 1
+    if batched and not config['human'] and config['save_for_gif']:
+        print('ERROR: save_for_gif needs num_envs and num_workers to be 1')
+        sys.exit(1)
+    if batched and not config['human'] and config.get('record_trajectories'):
+        print('ERROR: record_trajectories needs num_envs and num_workers to be 1')
+        sys.exit(1)
+    if params.get('agent', 'dqn') == 'tabular' and not config['human']:
+        if params['state_definition_type'] not in BINARY_STATE_DEFINITIONS:
+            print('ERROR: the tabular agent needs one of the state_definition_types '
+                  f'{sorted(BINARY_STATE_DEFINITIONS)}')
+            sys.exit(1)
+        if params.get('num_actors', 1) > 1:
+            print('ERROR: the tabular agent can\'t be combined with num_actors')
+            sys.exit(1)
+    if params.get('num_actors', 1) > 1 and not config['human']:
+        if batched or config['save_for_gif'] or config.get('record_trajectories'):
+            print('ERROR: num_actors can\'t be combined with num_envs, num_workers, '
+                  'save_for_gif, or record_trajectories')
+            sys.exit(1)
+        if config.get('checkpoint_every') or resume_dir or config.get('profile_episodes')\
+                or config.get('export_policy_table'):
+            print('ERROR: num_actors can\'t be combined with checkpoints, profiling, '
+                  'or export_policy_table')
+            sys.exit(1)
+    if config.get('export_policy_table') and not config['human']:
+        if params['state_definition_type'] not in BINARY_STATE_DEFINITIONS:
+            print('ERROR: export_policy_table needs one of the state_definition_types '
+                  f'{sorted(BINARY_STATE_DEFINITIONS)}')
+            sys.exit(1)
+    if params.get('num_workers', 1) > 1 and not config['human']:
+        # Each worker process runs its own game to use every core.
+        from workers import SnakeWorkerPool
+        env = SnakeWorkerPool(config)
+    elif params.get('num_envs', 1) > 1 and not config['human']:
+        # Several games are stepped together to gather experience faster.
+        env = SnakeVecEnv(config)
+    else:
+        env = Snake(config)
     # If we are just playing the game, no folders should be created.
     if config['human']:
-        while True:
-            env.run_game()
+        try:
+            while True:
+                env.run_game()
+        finally: # Closing the window exits, but saved frames still get written.
+            env.close()
 
     if not config['human']:
-        history = train_dqn(env, params)
+        from agent import train_dqn
+        from plotting import plot_history
         # If an agent plays, create a folder to store our learning curve graph.
         instance_dir = figures_dir/instance_folder
         instance_dir.mkdir(exist_ok=True, parents=True)
+        # Phase timings and profiles are only collected when asked for.
+        timer = NULL_TIMER
+        if config.get('instrument'):
+            timer = PhaseTimer(instance_dir/f'timings-{params_str}.jsonl')
+        profiler = None
+        if config.get('profile_episodes'):
+            profiler = EpisodeProfiler(config['profile_episodes'],
+                                       instance_dir/'profiles')
+        checkpointer = None
+        if config.get('checkpoint_every') or resume_dir:
+            checkpointer = Checkpointer(instance_dir/'checkpoints',
+                                        every=config.get('checkpoint_every', 0))
+        table_path = None
+        if config.get('export_policy_table'):
+            table_path = instance_dir/f'policy-table-{params_str}.npy'
+        # Every episode's metrics are streamed to a log as training runs, and
+        # a live learning curve is redrawn from it if asked for.
+        metrics = MetricsLog(instance_dir/f'metrics-{params_str}.csv',
+                             window=config.get('metrics_window', 100),
+                             plot_path=instance_dir/f'live-curve-{params_str}.png'
+                                 if config.get('plot_every') else None,
+                             plot_every=config.get('plot_every', 0))
+        try:
+            history = train_dqn(env, params, timer, profiler, checkpointer,
+                                table_path, metrics)
+        finally:
+            env.close()
+            timer.close()
+            metrics.close()
+            if checkpointer:
+                checkpointer.close()
         plot_name = f'learning-curve-{params_str}.png'
         plot_history(history, outpath=instance_dir/plot_name, params=params)
-    if config['make_gif']:
-        png_dir = eps_dir.parent/'png'
+    if config['make_gif'] and config['save_for_gif']:
+        from gif_creator import make_gif_from_frames
         gif_name = f'training-montage-{params_str}.gif'
-        bob_the_builder = GifBuilder(config['eps_dir'], png_dir)
-        bob_the_builder.convert_eps_files()
-        bob_the_builder.make_gif(outpath=figures_dir/instance_folder/gif_name)
+        make_gif_from_frames(frames_dir, outpath=figures_dir/instance_folder/gif_name)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
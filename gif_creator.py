@@ -1,50 +1,137 @@
-from PIL import EpsImagePlugin, Image
+from PIL import EpsImagePlugin, GifImagePlugin, Image
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
 from pathlib import Path
 from tqdm import tqdm
+from recorder import FrameRecorder, iter_frames
 
 # This script requires a separate installation of Ghostscript!
 EpsImagePlugin.gs_windows_binary = r'C:\Program Files\gs\gs9.55.0\bin\gswin64c'
 
+def eps2png(eps_fpath:Path, png_dir:Path):
+    '''
+    converts one eps file into a png file of the same name (this lives at the
+    module level so that worker processes can run it)
+    '''
+    png_fname = eps_fpath.name.replace('.eps','.png')
+    im = Image.open(eps_fpath)
+    fig = im.convert('RGBA')
+    fig.save(png_dir/png_fname)
+    im.close()
+
+def make_palette(colors):
+    '''
+    creates a palette image holding exactly the given RGB colors
+    '''
+    palette = Image.new('P', (1, 1))
+    flat = [channel for color in colors for channel in color]
+    palette.putpalette(flat + flat[-3:]*(256 - len(colors)))
+    return palette
+
+class GifWriter:
+    '''
+    Streams frames into an animated gif one at a time, so that memory use
+    doesn't grow with the number of frames.
+
+    The first frame's palette (or a given one) is reused for every frame, so
+    the gif has a single global color table and frames are quantized against
+    it without building a new palette each time.
+    '''
+    def __init__(self, outpath:Path, duration=20, loop=0, palette=None):
+        outpath.parent.mkdir(exist_ok=True, parents=True)
+        self.fp = open(outpath, 'wb')
+        # A note on animation speed: a duration of 20ms means 50fps, which is
+        # the max for what most web browsers support. Image viewers like
+        # IrfanView can play gifs up to 100fps.
+        self.duration = duration
+        self.loop = loop # 0 makes the gif loop infinitely.
+        self.palette = palette
+        self.num_frames = 0
+
+    def append(self, image):
+        '''
+        quantizes a frame to the shared palette and writes it to the gif
+        '''
+        image = image.convert('RGB')
+        if self.palette is None:
+            self.palette = image.quantize(colors=256)
+        frame = image.quantize(palette=self.palette, dither=Image.NONE)
+        if self.num_frames == 0:
+            header, _ = GifImagePlugin.getheader(frame, info={'loop':self.loop})
+            self.fp.writelines(header)
+        self.fp.writelines(GifImagePlugin.getdata(frame, duration=self.duration))
+        self.num_frames += 1
+
+    def close(self):
+        if self.fp.closed:
+            return
+        self.fp.write(b';') # the gif trailer
+        self.fp.close()
+
+def make_gif_from_frames(frames_dir:Path, outpath:Path=Path.cwd()/'training_montage.gif',
+                         every=1):
+    '''
+    streams the RGB frames that FrameRecorder saved into a gif, keeping only
+    every kth frame, so neither Ghostscript nor png files are needed
+    '''
+    # Recorded frames only ever use the recorder's colors.
+    palette = make_palette([FrameRecorder.BG_COLOR, FrameRecorder.SNAKE_COLOR,
+                            FrameRecorder.APPLE_COLOR])
+    frames = islice(iter_frames(frames_dir), 0, None, every)
+    print('creating gif (this may take some time)')
+    writer = GifWriter(outpath, palette=palette)
+    try:
+        for _, _, frame in tqdm(frames):
+            writer.append(Image.fromarray(frame))
+    except Exception as e:
+        print(f'ERROR: gif creation failed: {e}')
+    finally:
+        writer.close()
+    if writer.num_frames == 0:
+        print(f'ERROR: no frames found in {frames_dir}')
+        return
+    print(f'gif exported to {outpath}')
+
 class GifBuilder:
-    def __init__(self, eps_dir:Path, png_dir:Path):
+    '''
+    converts the eps files that older versions of explore.py saved into png
+    files and those into a gif, which needs Ghostscript
+    '''
+    def __init__(self, eps_dir:Path, png_dir:Path, num_workers=None):
         self.eps_dir = eps_dir
         self.png_dir = png_dir
-
-    def _eps2png(self, eps_fpath:Path):
-        png_fname = eps_fpath.name.replace('.eps','.png')
-        im = Image.open(eps_fpath)
-        fig = im.convert('RGBA')
-        fig.save(self.png_dir/png_fname)
-        im.close()
+        self.num_workers = num_workers # None uses every core.
 
     def convert_eps_files(self):
         if not self.png_dir.exists():
             self.png_dir.mkdir(parents=True)
-        eps_fpaths = [eps_fpath for eps_fpath in self.eps_dir.glob('*.eps')]
+        eps_fpaths = sorted(self.eps_dir.glob('*.eps'))
         print('converting eps files to png (this may take some time)')
-        for eps_fpath in tqdm(eps_fpaths):
-            self._eps2png(Path(eps_fpath))
-
-    def make_gif(self, outpath:Path=Path.cwd()/'training_montage.gif'):
-        png_fpaths = [png_file for png_file in self.png_dir.glob('*.png')]
-        image_list = []
-        # Note that we open and close a temp file to avoid potentially opening
-        # several thousand files at once.
-        for png_file in tqdm(png_fpaths):
-            temp = Image.open(png_file)
-            keep = temp.copy()
-            image_list.append(keep)
-            temp.close()
-        if not outpath.exists():
-            outpath.parent.mkdir(exist_ok=True, parents=True)
-        im = image_list.pop(0) # The gif builds by appending to a base image.
+        # Each conversion runs Ghostscript on its own, so they spread well
+        # over a pool of processes.
+        with ProcessPoolExecutor(max_workers=self.num_workers) as pool:
+            conversions = pool.map(partial(eps2png, png_dir=self.png_dir),
+                                   eps_fpaths, chunksize=16)
+            for _ in tqdm(conversions, total=len(eps_fpaths)):
+                pass
+
+    def make_gif(self, outpath:Path=Path.cwd()/'training_montage.gif', every=1):
+        '''
+        streams the png files into a gif in episode and step order, keeping
+        only every kth frame
+        '''
+        # The zero-padded ep#########-stp######### names sort chronologically.
+        png_fpaths = sorted(self.png_dir.glob('*.png'))[::every]
         print('creating gif (this may take some time)')
+        writer = GifWriter(outpath)
         try:
-            # A note on animation speed: a duration of 20ms means 50fps, which
-            # is the max for what most web browsers support. Image viewers like
-            # IrfanView can play gifs up to 100fps.
-            im.save(outpath, save_all=True, append_images=image_list,
-                    duration=20, loop=0) # 0 makes the gif loop infinitely.
+            for png_file in tqdm(png_fpaths):
+                # Only one file is open at a time, even for thousands of frames.
+                with Image.open(png_file) as im:
+                    writer.append(im)
         except Exception as e:
             print(f'ERROR: gif creation failed: {e}')
-        print(f'gif exported to {outpath}')
\ No newline at end of file
+        finally:
+            writer.close()
+        print(f'gif exported to {outpath}')
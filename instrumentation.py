@@ -0,0 +1,163 @@
+import cProfile
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+'''
+Timing the training loop is opt-in. Instrumented code asks a timer for the
+current time before a phase and hands that start time back afterwards, which
+costs one perf_counter_ns call and a few dictionary updates per phase. The
+default NULL_TIMER ignores both calls, so uninstrumented runs only pay for two
+empty method calls.
+'''
+
+class NullTimer:
+    '''
+    a timer that records nothing
+    '''
+    def now(self):
+        return 0
+
+    def add(self, phase, start):
+        pass
+
+    def end_episode(self, episode_number):
+        pass
+
+    def close(self):
+        pass
+
+NULL_TIMER = NullTimer()
+
+class PhaseTimer(NullTimer):
+    '''
+    Counts calls, total time, and a histogram of durations for each phase of
+    the training loop, and appends one JSON line per episode to a file.
+
+    Histogram bucket k counts durations of 2^(k-1) up to 2^k nanoseconds, so a
+    phase's distribution costs a fixed NUM_BUCKETS counters.
+    '''
+    NUM_BUCKETS = 40
+
+    def __init__(self, outpath:Path):
+        self.outpath = Path(outpath)
+        self.outpath.parent.mkdir(exist_ok=True, parents=True)
+        self.file = open(self.outpath, 'a')
+        self.now = time.perf_counter_ns # skips a method call on the hot path
+        self.counts = {}
+        self.totals = {}
+        self.histograms = {}
+
+    def add(self, phase, start):
+        '''
+        records that a phase ran from start until now
+        '''
+        elapsed = time.perf_counter_ns() - start
+        if phase not in self.counts:
+            self.counts[phase] = self.totals[phase] = 0
+            self.histograms[phase] = [0]*self.NUM_BUCKETS
+        self.counts[phase] += 1
+        self.totals[phase] += elapsed
+        self.histograms[phase][min(elapsed.bit_length(), self.NUM_BUCKETS - 1)] += 1
+
+    def percentile(self, phase, q):
+        '''
+        estimates a percentile of a phase's durations in microseconds from the
+        upper edge of the histogram bucket it falls in
+        '''
+        target = q/100*self.counts[phase]
+        seen = 0
+        for k, count in enumerate(self.histograms[phase]):
+            seen += count
+            if count and seen >= target:
+                return 2**k/1000
+        return 0.0
+
+    def summary(self):
+        '''
+        summarizes every phase timed since the last episode ended
+        '''
+        return {phase:{'count':count,
+                       'total_ms':self.totals[phase]/1e6,
+                       'mean_us':self.totals[phase]/count/1e3,
+                       'p50_us':self.percentile(phase, 50),
+                       'p99_us':self.percentile(phase, 99),
+                       # Only the non-empty buckets are kept, keyed by their
+                       # upper edge in nanoseconds.
+                       'histogram_ns':{2**k:n for k, n in
+                                       enumerate(self.histograms[phase]) if n}}
+                for phase, count in self.counts.items()}
+
+    def end_episode(self, episode_number):
+        '''
+        writes the episode's timings as one JSON line and starts counting anew
+        '''
+        self.file.write(json.dumps({'episode':episode_number,
+                                    'phases':self.summary()}) + '\n')
+        self.file.flush()
+        self.counts.clear()
+        self.totals.clear()
+        self.histograms.clear()
+
+    def close(self):
+        self.file.close()
+
+class EpisodeProfiler:
+    '''
+    runs cProfile during the chosen episodes and saves one stats file per
+    episode, which `python -m pstats` or snakeviz can open
+    '''
+    def __init__(self, episodes, outdir:Path):
+        self.episodes = set(episodes)
+        self.outdir = Path(outdir)
+        self.profile = None
+
+    def begin(self, episode_number):
+        if episode_number not in self.episodes:
+            return
+        self.outdir.mkdir(exist_ok=True, parents=True)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def end(self, episode_number):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        self.profile.dump_stats(self.outdir/f'profile-ep{episode_number:09d}.prof')
+        self.profile = None
+
+def measure_import_cost(module, cwd=None):
+    '''
+    Imports a module in a fresh interpreter with -X importtime and returns
+    the seconds its import took (including everything it imported, since
+    nothing is cached yet) along with its direct imports as (name, seconds)
+    pairs from most to least expensive, or (None, []) if the import failed.
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True,
+                            cwd=cwd if cwd else Path(__file__).parent)
+    if result.returncode:
+        return None, []
+    total, children = None, []
+    # Each line reads 'import time: self [us] | cumulative [us] | name', with
+    # the name indented by its depth: one space for the module itself and
+    # three for the modules it imports directly.
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue # the header
+        name = fields[2].rstrip()
+        seconds = int(fields[1])/1e6
+        depth = len(name) - len(name.lstrip(' '))
+        if depth == 1: # A module's own line comes right after its imports'.
+            if name.strip() == module:
+                total = seconds
+                break
+            children = []
+        elif depth == 3:
+            children.append((name.strip(), seconds))
+    return total, sorted(children, key=lambda child: -child[1])
@@ -1,19 +1,24 @@
-from gif_creator import GifBuilder
+from gif_creator import make_gif_from_frames
 from pathlib import Path
 
 # After running explore.py with `"save_for_gif": true`, this script allows us
-# to loop through the saved eps files and turn them into an animated gif.
+# to loop through the saved frames and turn them into an animated gif. It can
+# also still convert eps files saved by older versions of explore.py.
 
 figures_dir = Path(r".\figures")
 instance_folder = 'test-animation-2-MonJan17-095750-default-50ep-256batch'
 instance_dir = figures_dir/instance_folder
 
 config = {
+    'frames_dir':instance_dir/'gif-build'/'frames',
     'eps_dir':instance_dir/'gif-build'/'eps',
     'png_dir':instance_dir/'gif-build'/'png',
     'outpath':instance_dir/'animation.gif'
 }
 
-bob_the_builder = GifBuilder(config['eps_dir'], config['png_dir'])
+make_gif_from_frames(config['frames_dir'], outpath=config['outpath'])
+# For eps files, use these lines instead.
+#from gif_creator import GifBuilder
+#bob_the_builder = GifBuilder(config['eps_dir'], config['png_dir'])
 #bob_the_builder.convert_eps_files() # Toggle this off if you already have pngs.
-bob_the_builder.make_gif(outpath=config['outpath'])
\ No newline at end of file
+#bob_the_builder.make_gif(outpath=config['outpath'])
\ No newline at end of file
@@ -0,0 +1,211 @@
+import numpy as np
+from pathlib import Path
+
+class ReplayBuffer:
+    '''
+    a fixed-size experience replay memory backed by preallocated NumPy arrays
+    '''
+    def __init__(self, capacity, state_space, seed=None, memmap_dir=None,
+                 state_dtype=np.float32):
+        self.capacity = capacity
+        self.state_space = state_space # elements per stored observation
+        self.rng = np.random.default_rng(seed)
+        self.memmap_dir = Path(memmap_dir) if memmap_dir else None
+        # Every transition field gets one contiguous array. The write cursor
+        # wraps around, so the oldest transitions are overwritten first.
+        # Bit-packed observations are stored packed (state_dtype uint8).
+        self.states = self.allocate('states', (capacity, state_space), state_dtype)
+        self.actions = self.allocate('actions', (capacity,), np.int64)
+        self.rewards = self.allocate('rewards', (capacity,), np.float32)
+        self.next_states = self.allocate('next_states', (capacity, state_space), state_dtype)
+        self.dones = self.allocate('dones', (capacity,), np.float32)
+        self.cursor = 0 # where the next transition will be written
+        self.size = 0   # how many transitions are stored
+
+    def allocate(self, name, shape, dtype):
+        '''
+        creates the array for one transition field, which is memory-mapped to
+        a .npy file (reopening one that already fits) if there's a memmap_dir
+        '''
+        if self.memmap_dir is None:
+            return np.zeros(shape, dtype=dtype)
+        self.memmap_dir.mkdir(exist_ok=True, parents=True)
+        fpath = self.memmap_dir/f'{name}.npy'
+        if fpath.exists():
+            array = np.lib.format.open_memmap(fpath, mode='r+')
+            if array.shape == shape and array.dtype == dtype:
+                return array
+            del array
+        return np.lib.format.open_memmap(fpath, mode='w+', dtype=dtype, shape=shape)
+
+    def flush(self):
+        '''
+        writes memory-mapped transitions through to their files
+        '''
+        if self.memmap_dir is None:
+            return
+        for array in (self.states, self.actions, self.rewards,
+                      self.next_states, self.dones):
+            array.flush()
+
+    def get_state(self):
+        '''
+        returns everything besides the transitions themselves that's needed to
+        pick up where this buffer left off
+        '''
+        return {'cursor':self.cursor, 'size':self.size, 'rng':self.rng}
+
+    def set_state(self, state):
+        self.cursor = state['cursor']
+        self.size = state['size']
+        self.rng = state['rng']
+
+    def __len__(self):
+        return self.size
+
+    def add(self, states, actions, rewards, next_states, dones):
+        '''
+        writes one transition, or a batch of them given as arrays with one row
+        per transition, and returns the indices they were written to
+        '''
+        states = np.reshape(states, (-1, self.state_space))
+        n = len(states)
+        indices = (self.cursor + np.arange(n)) % self.capacity
+        self.states[indices] = states
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.next_states[indices] = np.reshape(next_states, (-1, self.state_space))
+        self.dones[indices] = dones
+        self.cursor = (self.cursor + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        return indices
+
+    def get(self, indices):
+        '''
+        gathers the transitions at the given indices
+        '''
+        return self.states[indices], self.actions[indices],\
+            self.rewards[indices], self.next_states[indices], self.dones[indices]
+
+    def sample(self, batch_size):
+        '''
+        draws a random minibatch of distinct transitions
+        '''
+        indices = self.rng.choice(self.size, batch_size, replace=False)
+        return self.get(indices)
+
+class SumTree:
+    '''
+    a binary tree stored in a flat array where every node holds the sum of its
+    children, so priorities update and sample in O(log n)
+    '''
+    def __init__(self, capacity):
+        # The leaves are padded to a power of two so that every leaf sits at
+        # the same depth. Node i has children 2i and 2i+1, and node 1 is the
+        # root, which holds the sum of every priority.
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.tree = np.zeros(2*self.leaves)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices):
+        '''
+        reads the priorities stored at the given leaf indices
+        '''
+        return self.tree[np.asarray(indices) + self.leaves]
+
+    def update(self, indices, priorities):
+        '''
+        sets the priorities of a batch of leaves and refreshes their ancestors
+        one level at a time
+        '''
+        nodes = np.asarray(indices) + self.leaves
+        self.tree[nodes] = priorities
+        while self.leaves > 1:
+            nodes = np.unique(nodes//2)
+            self.tree[nodes] = self.tree[2*nodes] + self.tree[2*nodes + 1]
+            if nodes[0] == 1:
+                break
+
+    def find(self, targets):
+        '''
+        finds, for each target in [0, total), the leaf whose cumulative
+        priority range contains it
+        '''
+        targets = np.array(targets, dtype=np.float64)
+        nodes = np.ones(len(targets), dtype=np.int64)
+        while nodes[0] < self.leaves:
+            left = 2*nodes
+            go_right = targets > self.tree[left]
+            targets -= np.where(go_right, self.tree[left], 0)
+            nodes = left + go_right
+        return nodes - self.leaves
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    '''
+    a replay memory that samples transitions in proportion to their last
+    temporal-difference (TD) error rather than uniformly
+    '''
+    def __init__(self, capacity, state_space, alpha=0.6, beta=0.4,
+                 beta_increment=0.001, epsilon=1e-6, seed=None, memmap_dir=None,
+                 state_dtype=np.float32):
+        super(PrioritizedReplayBuffer, self).__init__(capacity, state_space, seed,
+                                                      memmap_dir, state_dtype)
+        self.tree = SumTree(capacity)
+        self.alpha = alpha # how strongly priorities skew sampling (0 is uniform)
+        self.beta = beta   # how strongly importance weights correct that skew
+        self.beta_increment = beta_increment # how fast beta anneals to 1
+        self.epsilon = epsilon # keeps every transition's priority above 0
+        self.max_priority = 1.0
+
+    def get_state(self):
+        state = super(PrioritizedReplayBuffer, self).get_state()
+        state.update({'tree':self.tree.tree.copy(), 'beta':self.beta,
+                      'max_priority':self.max_priority})
+        return state
+
+    def set_state(self, state):
+        super(PrioritizedReplayBuffer, self).set_state(state)
+        self.tree.tree[:] = state['tree']
+        self.beta = state['beta']
+        self.max_priority = state['max_priority']
+
+    def add(self, states, actions, rewards, next_states, dones):
+        '''
+        writes transitions with the highest priority seen so far, so that each
+        one is replayed at least once before its TD error is known
+        '''
+        indices = super(PrioritizedReplayBuffer, self).add(
+            states, actions, rewards, next_states, dones)
+        self.tree.update(indices, self.max_priority)
+        return indices
+
+    def sample(self, batch_size):
+        '''
+        draws a minibatch in proportion to priority and returns it along with
+        the sampled indices and their importance-sampling weights
+        '''
+        # Split the total priority into equal segments and draw one target from
+        # each, which spreads the minibatch over the whole distribution.
+        bounds = np.linspace(0, self.tree.total(), batch_size + 1)
+        targets = self.rng.uniform(bounds[:-1], bounds[1:])
+        # Rounding can push a target past the last stored transition.
+        indices = np.minimum(self.tree.find(targets), self.size - 1)
+        probabilities = self.tree.get(indices)/self.tree.total()
+        # Frequently sampled transitions get smaller updates so that the
+        # expected gradient stays the same as under uniform sampling.
+        weights = (self.size*probabilities)**(-self.beta)
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return (*self.get(indices), indices, weights.astype(np.float32))
+
+    def update_priorities(self, indices, td_errors):
+        '''
+        sets the priorities of replayed transitions from their new TD errors
+        '''
+        priorities = (np.abs(td_errors) + self.epsilon)**self.alpha
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities)
@@ -0,0 +1,262 @@
+import math
+import os
+import time
+import numpy as np
+from argparse import ArgumentParser
+from collections import deque
+from pathlib import Path
+
+'''
+Training streams one row per finished episode to an append-only CSV log, so a
+run can be followed while it's still going and nothing but a small rolling
+window has to stay in memory. Each row holds the episode's number, total
+reward, length in steps, apples eaten, the agent's epsilon, the seconds since
+training started, and the mean and standard deviation of the total reward over
+the last `window` episodes.
+
+The log can be plotted while it grows. A LiveCurve only reads the rows added
+since its last refresh and folds them into at most max_buckets buckets of
+episodes (keeping each bucket's min, mean, and max), doubling the episodes per
+bucket whenever it runs out, so refreshing stays cheap however long the run
+gets. Besides the refreshes that training can make itself, a log can be
+watched from another process with
+    python metrics.py <metrics csv> -o <png> -e <seconds>
+'''
+
+COLUMNS = ['episode', 'reward', 'length', 'apples', 'epsilon', 'wall_time',
+           'rolling_mean', 'rolling_std']
+
+class RollingStats:
+    '''
+    the mean and standard deviation of the last `window` values, updated in
+    O(1) per value from running sums
+    '''
+    def __init__(self, window=100):
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def add(self, value):
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value*value
+        if len(self.values) > self.window:
+            old = self.values.popleft()
+            self.total -= old
+            self.total_sq -= old*old
+
+    @property
+    def mean(self):
+        return self.total/len(self.values) if self.values else 0.0
+
+    @property
+    def std(self):
+        if not self.values:
+            return 0.0
+        return math.sqrt(max(self.total_sq/len(self.values) - self.mean**2, 0.0))
+
+class MetricsLog:
+    '''
+    appends one row of metrics per finished episode to a CSV file and, given
+    a plot_path, redraws a LiveCurve of it every plot_every seconds
+    '''
+    def __init__(self, path:Path, window=100, plot_path=None, plot_every=0):
+        self.path = Path(path)
+        self.stats = RollingStats(window)
+        self.plot_every = plot_every
+        self.curve = LiveCurve(self.path, plot_path) if plot_path else None
+        self.file = None
+        self.start = time.perf_counter()
+        self.time_offset = 0.0 # seconds logged before a resumed run started
+        self.last_plot = self.start
+
+    def begin(self, first_episode=0):
+        '''
+        opens the log for appending, first dropping any rows from first_episode
+        on, which a resumed run is about to play again
+        '''
+        if self.path.exists():
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(self.path) as src, open(tmp_path, 'w') as dst:
+                dst.write(src.readline()) # the header
+                for line in src:
+                    if not line.endswith('\n'): # cut off mid-write
+                        break
+                    row = line.split(',')
+                    if int(row[0]) >= first_episode:
+                        break
+                    dst.write(line)
+                    self.stats.add(float(row[1]))
+                    self.time_offset = float(row[5])
+            os.replace(tmp_path, self.path)
+        else:
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            self.path.write_text(','.join(COLUMNS) + '\n')
+        # Line buffering hands every row to the OS right away for any readers.
+        self.file = open(self.path, 'a', buffering=1)
+        self.start = time.perf_counter()
+
+    def log(self, episode, reward, length, apples, epsilon):
+        '''
+        appends one episode's row and refreshes the plot if it's due
+        '''
+        if self.file is None:
+            self.begin()
+        self.stats.add(reward)
+        now = time.perf_counter()
+        wall_time = self.time_offset + now - self.start
+        self.file.write(f'{episode},{reward},{length},{apples},{epsilon:.6g},'
+                        f'{wall_time:.3f},{self.stats.mean:.4f},{self.stats.std:.4f}\n')
+        if self.curve and self.plot_every and now - self.last_plot >= self.plot_every:
+            self.curve.refresh()
+            self.last_plot = now
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.curve:
+            self.curve.refresh()
+
+class MetricsTail:
+    '''
+    reads the whole rows that were appended to a metrics log since the last read
+    '''
+    def __init__(self, path:Path):
+        self.path = Path(path)
+        self.offset = 0
+        self.columns = None
+
+    def read(self):
+        '''
+        returns the new rows as a dict of column arrays (empty if there are none)
+        '''
+        if not self.path.exists():
+            return {}
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1 # A row that's still being written waits.
+        self.offset += end
+        lines = data[:end].decode().splitlines()
+        if self.columns is None and lines:
+            self.columns = lines.pop(0).split(',')
+        if not lines:
+            return {}
+        rows = np.loadtxt(lines, delimiter=',', ndmin=2)
+        return {name:rows[:, i] for i, name in enumerate(self.columns)}
+
+class Downsampler:
+    '''
+    folds a stream of values into at most max_buckets equal buckets, keeping
+    each bucket's count, min, sum, max, and the last value of a second series
+    '''
+    def __init__(self, max_buckets=1000):
+        self.max_buckets = max_buckets - max_buckets % 2 # Merging pairs needs an even count.
+        self.width = 1 # values per bucket
+        self.num_values = 0
+        self.count = np.zeros(0, dtype=np.int64)
+        self.min = np.zeros(0)
+        self.sum = np.zeros(0)
+        self.max = np.zeros(0)
+        self.last = np.zeros(0)
+
+    def grow(self, num_buckets):
+        '''
+        adds empty buckets until there are num_buckets of them
+        '''
+        extra = num_buckets - len(self.count)
+        if extra <= 0:
+            return
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.min = np.concatenate([self.min, np.full(extra, np.inf)])
+        self.sum = np.concatenate([self.sum, np.zeros(extra)])
+        self.max = np.concatenate([self.max, np.full(extra, -np.inf)])
+        self.last = np.concatenate([self.last, np.full(extra, np.nan)])
+
+    def merge(self):
+        '''
+        merges neighboring buckets, doubling how many values each one covers
+        '''
+        self.grow(len(self.count) + len(self.count) % 2)
+        pairs = lambda array: array.reshape(-1, 2)
+        later_empty = pairs(self.count)[:, 1] == 0
+        self.last = np.where(later_empty, pairs(self.last)[:, 0], pairs(self.last)[:, 1])
+        self.count = pairs(self.count).sum(axis=1)
+        self.min = pairs(self.min).min(axis=1)
+        self.sum = pairs(self.sum).sum(axis=1)
+        self.max = pairs(self.max).max(axis=1)
+        self.width *= 2
+
+    def add(self, values, last=None):
+        '''
+        adds a batch of values (and their values of the second series)
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        positions = self.num_values + np.arange(len(values))
+        while positions[-1]//self.width >= self.max_buckets:
+            self.merge()
+        buckets = positions//self.width
+        self.grow(buckets[-1] + 1)
+        np.add.at(self.count, buckets, 1)
+        np.minimum.at(self.min, buckets, values)
+        np.add.at(self.sum, buckets, values)
+        np.maximum.at(self.max, buckets, values)
+        if last is not None:
+            # Positions only increase, so a bucket's last value ends its run.
+            ends = np.append(buckets[1:] != buckets[:-1], True)
+            self.last[buckets[ends]] = np.asarray(last)[ends]
+        self.num_values += len(values)
+
+    @property
+    def mean(self):
+        return self.sum/np.maximum(self.count, 1)
+
+class LiveCurve:
+    '''
+    keeps a downsampled learning curve of a growing metrics log and redraws it
+    from only the rows added since the last refresh
+    '''
+    def __init__(self, log_path:Path, outpath:Path, max_buckets=1000):
+        self.tail = MetricsTail(log_path)
+        self.outpath = Path(outpath)
+        self.rewards = Downsampler(max_buckets)
+        self.first_episode = None
+
+    def refresh(self):
+        from plotting import plot_buckets
+        rows = self.tail.read()
+        if rows:
+            if self.first_episode is None:
+                self.first_episode = int(rows['episode'][0])
+            self.rewards.add(rows['reward'], last=rows['rolling_mean'])
+        if self.rewards.num_values:
+            plot_buckets(self.rewards, self.outpath, first_episode=self.first_episode)
+
+def parse_args():
+    parser = ArgumentParser(description='plot a metrics log while it grows')
+    parser.add_argument('log', help='the metrics csv file to watch')
+    parser.add_argument('-o', '--outpath', dest='outpath', required=False,
+                        help='where to save the plot (default: next to the log)')
+    parser.add_argument('-e', '--every', dest='every', type=float, default=30,
+                        help='seconds between refreshes (0 plots once and exits)')
+    parser.add_argument('-b', '--buckets', dest='buckets', type=int, default=1000,
+                        help='the most buckets of episodes to plot')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    log_path = Path(args.log)
+    outpath = Path(args.outpath) if args.outpath else log_path.with_suffix('.png')
+    curve = LiveCurve(log_path, outpath, args.buckets)
+    try:
+        while True:
+            curve.refresh()
+            if not args.every:
+                break
+            time.sleep(args.every)
+    except KeyboardInterrupt:
+        pass
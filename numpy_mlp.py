@@ -0,0 +1,198 @@
+import numpy as np
+from policy import forward
+
+'''
+The Q network is a small stack of Dense layers (ReLU hidden layers and a
+softmax output), so its forward pass, backpropagation, and Adam update are only
+a few NumPy matrix products each. At this size that's much faster per update
+than a TensorFlow graph call, and it needs nothing but NumPy, so a DQN can train
+where TensorFlow isn't installed (set "backend": "numpy" in the params).
+
+A NumpyMLP mirrors the parts of a Keras model that the rest of the project
+uses. get_weights and set_weights list each layer's kernel followed by its
+bias, and optimizer.variables lists Adam's iteration count, its learning rate,
+and a momentum and velocity slot per weight, all in the order and shapes that
+Keras 3 uses. Weights and checkpoints therefore move freely between the two
+backends, and from_keras and to_keras convert whole models.
+'''
+
+class Variable:
+    '''
+    an array that's read with np.array and overwritten in place with assign,
+    like a Keras variable
+    '''
+    def __init__(self, value):
+        self.value = value
+
+    def assign(self, value):
+        self.value[...] = value
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.value, dtype=dtype)
+
+class NumpyAdam:
+    '''
+    Adam with Keras' update rule and defaults, applied in place to a list of
+    NumPy arrays
+    '''
+    def __init__(self, params, learning_rate=0.001, beta_1=0.9, beta_2=0.999,
+                 epsilon=1e-7):
+        self.params = params
+        self.beta_1 = beta_1
+        self.beta_2 = beta_2
+        self.epsilon = epsilon
+        self.iteration = np.zeros((), dtype=np.int64)
+        self.learning_rate = np.array(learning_rate, dtype=np.float32)
+        self.momentums = [np.zeros_like(param) for param in params]
+        self.velocities = [np.zeros_like(param) for param in params]
+
+    @property
+    def variables(self):
+        slots = [Variable(slot) for pair in zip(self.momentums, self.velocities)
+                 for slot in pair]
+        return [Variable(self.iteration), Variable(self.learning_rate), *slots]
+
+    def apply_gradients(self, gradients):
+        '''
+        takes one Adam step with one gradient per parameter
+        '''
+        step = int(self.iteration) + 1
+        # Bias correction is folded into the step size, just like in Keras.
+        alpha = float(self.learning_rate)*np.sqrt(1 - self.beta_2**step)/(1 - self.beta_1**step)
+        for param, grad, m, v in zip(self.params, gradients, self.momentums,
+                                     self.velocities):
+            m += (grad - m)*(1 - self.beta_1)
+            v += (grad*grad - v)*(1 - self.beta_2)
+            param -= alpha*m/(np.sqrt(v) + self.epsilon)
+        self.iteration[...] = step
+
+class NumpyMLP:
+    '''
+    a Q network of Dense layers with ReLU hidden layers and a softmax output,
+    trained with Adam entirely in NumPy
+    '''
+    def __init__(self, state_space, layer_sizes, action_space, learning_rate=0.001,
+                 seed=None):
+        self.state_space = state_space
+        self.layer_sizes = list(layer_sizes)
+        self.action_space = action_space
+        rng = np.random.default_rng(seed)
+        sizes = [state_space, *self.layer_sizes, action_space]
+        self.kernels, self.biases = [], []
+        for fan_in, fan_out in zip(sizes[:-1], sizes[1:]):
+            # Keras' default Glorot uniform kernels and zero biases
+            limit = np.sqrt(6/(fan_in + fan_out))
+            self.kernels.append(rng.uniform(-limit, limit, (fan_in, fan_out)).astype(np.float32))
+            self.biases.append(np.zeros(fan_out, dtype=np.float32))
+        self.optimizer = NumpyAdam(self.get_params(), learning_rate)
+
+    def get_params(self):
+        '''
+        returns the live weight arrays, each kernel followed by its bias
+        '''
+        return [param for layer in zip(self.kernels, self.biases) for param in layer]
+
+    def get_weights(self):
+        '''
+        returns a copy of the weights in Keras' order
+        '''
+        return [param.copy() for param in self.get_params()]
+
+    def set_weights(self, weights):
+        '''
+        overwrites the weights in place from a list in Keras' order
+        '''
+        params = self.get_params()
+        if [np.shape(weight) for weight in weights] != [param.shape for param in params]:
+            raise ValueError('the weights don\'t fit this network\'s layers')
+        for param, weight in zip(params, weights):
+            param[...] = weight
+
+    def predict(self, states):
+        return forward(list(zip(self.kernels, self.biases)), states)
+
+    def train_step(self, states, actions, rewards, next_states, dones, weights,
+                   gamma):
+        '''
+        fits Q(s, a) to the Bellman targets of a minibatch with one Adam step
+        and returns the TD errors, with the same loss as DQN's compiled
+        TensorFlow train step
+        '''
+        n = len(states)
+        rows = np.arange(n)
+        # Q(s) and Q(s') come from one forward pass over both batches, keeping
+        # every layer's input for backpropagation.
+        x = np.concatenate([states, next_states]).astype(np.float32, copy=False)
+        inputs = []
+        for kernel, bias in zip(self.kernels[:-1], self.biases[:-1]):
+            inputs.append(x)
+            x = np.maximum(x @ kernel + bias, 0) # ReLU
+        inputs.append(x)
+        x = x @ self.kernels[-1] + self.biases[-1]
+        x = np.exp(x - x.max(axis=1, keepdims=True)) # softmax
+        q_values = x/x.sum(axis=1, keepdims=True)
+        q, q_next = q_values[:n], q_values[n:]
+        targets = rewards + gamma*q_next.max(axis=1)*(1 - dones)
+        td_errors = targets - q[rows, actions]
+
+        # The loss is the weighted batch mean of each row's mean squared error
+        # over the actions, and only the actions taken are off their targets.
+        grad_q = np.zeros_like(q)
+        grad_q[rows, actions] = -2*weights*td_errors/(n*self.action_space)
+        # backpropagation through the softmax, then each Dense layer
+        grad = q*(grad_q - (grad_q*q).sum(axis=1, keepdims=True))
+        gradients = []
+        for layer in reversed(range(len(self.kernels))):
+            layer_input = inputs[layer][:n]
+            gradients += [grad.sum(axis=0), layer_input.T @ grad] # bias, kernel
+            if layer:
+                grad = (grad @ self.kernels[layer].T)*(layer_input > 0) # ReLU
+        self.optimizer.apply_gradients(gradients[::-1])
+        return td_errors
+
+    @classmethod
+    def from_keras(cls, model, seed=None):
+        '''
+        builds a NumpyMLP with a Keras model's layers, weights, learning rate,
+        and (once built) Adam slots
+        '''
+        from checkpoint import get_optimizer_variables
+        weights = model.get_weights()
+        kernels = weights[::2]
+        learning_rate = float(np.array(model.optimizer.learning_rate))
+        mlp = cls(kernels[0].shape[0], [kernel.shape[1] for kernel in kernels[:-1]],
+                  kernels[-1].shape[1], learning_rate, seed=seed)
+        mlp.set_weights(weights)
+        # Keras 2 lists Adam's variables differently, and those are skipped.
+        variables = get_optimizer_variables(model.optimizer)
+        if len(variables) == len(mlp.optimizer.variables):
+            for variable, value in zip(mlp.optimizer.variables, variables):
+                variable.assign(np.array(value))
+        return mlp
+
+    def to_keras(self):
+        '''
+        builds a compiled Keras model with this network's layers, weights,
+        learning rate, and (on Keras 3) Adam slots
+        '''
+        from keras import Sequential
+        from keras.layers import Dense
+        from tensorflow.keras.optimizers import Adam
+        from checkpoint import build_optimizer, get_optimizer_variables
+        model = Sequential()
+        for i, layer_size in enumerate(self.layer_sizes):
+            if i == 0:
+                model.add(Dense(layer_size, input_shape=(self.state_space,),
+                                activation='relu'))
+            else:
+                model.add(Dense(layer_size, activation='relu'))
+        model.add(Dense(self.action_space, activation='softmax'))
+        model.compile(loss='mse',
+                      optimizer=Adam(learning_rate=float(self.optimizer.learning_rate)))
+        model.set_weights(self.get_weights())
+        build_optimizer(model.optimizer, model.trainable_variables)
+        variables = get_optimizer_variables(model.optimizer)
+        if len(variables) == len(self.optimizer.variables):
+            for variable, value in zip(variables, self.optimizer.variables):
+                variable.assign(np.array(value))
+        return model
@@ -1,5 +1,6 @@
 import matplotlib as mpl
 from matplotlib import pyplot as plt
+import numpy as np
 import pandas as pd
 import json
 
@@ -30,10 +31,19 @@ def prepare_data_for_plotting(history, window_len=5):
         df['Total Reward'].rolling(window_len).mean()
     return df
 
+MAX_POINTS = 5000 # Longer histories are plotted as buckets of episodes.
+
 def plot_history(history, outpath=None, params=None):
     '''
     plots the historical total rewards data
     '''
+    if len(history) > MAX_POINTS:
+        from metrics import Downsampler
+        buckets = Downsampler(MAX_POINTS//5)
+        buckets.add(history)
+        plot_buckets(buckets, outpath if outpath else 'learning-curve.png',
+                     params=params, resolution=300)
+        return
     window_len = max(int(params.get('num_episodes')/5), 5)
     df = prepare_data_for_plotting(history, window_len=window_len)
     fig, ax = plt.subplots(figsize=(12,8))
@@ -47,4 +57,45 @@ def plot_history(history, outpath=None, params=None):
     plt.legend(df.columns.to_list(), loc='best')
     outpath = outpath if outpath else 'learning-curve.png'
     save_fig(outpath)
-    plt.close('all')
\ No newline at end of file
+    plt.close('all')
+
+def plot_histories(histories, labels, outpath=None, window_len=5):
+    '''
+    plots the rolling mean total rewards of several runs on one set of axes
+    '''
+    fig, ax = plt.subplots(figsize=(12,8))
+    for history, label in zip(histories, labels):
+        df = prepare_data_for_plotting(history, window_len=window_len)
+        ax.plot(df[f'Total Reward Rolling Mean (k={window_len})'], '-', label=label)
+    ax.set_title('Snake Agent Learning Curves')
+    ax.set_xlabel('Episode Number')
+    ax.set_ylabel(f'Total Episode Reward Rolling Mean (k={window_len})')
+    plt.legend(loc='best', fontsize='small')
+    outpath = outpath if outpath else 'learning-curves.png'
+    save_fig(outpath)
+    plt.close('all')
+
+def plot_buckets(buckets, outpath, first_episode=0, params=None, resolution=100):
+    '''
+    plots a learning curve downsampled by a metrics.Downsampler: each bucket
+    of episodes' mean total reward, shaded between its min and max, along with
+    the rolling mean at the end of each bucket if there is one
+    '''
+    filled = buckets.count > 0
+    x = first_episode + buckets.width*(np.flatnonzero(filled) + 0.5)
+    fig, ax = plt.subplots(figsize=(12,8))
+    ax.fill_between(x, buckets.min[filled], buckets.max[filled], alpha=0.3,
+                    label='Total Reward Min/Max')
+    ax.plot(x, buckets.mean[filled], '-',
+            label=f'Total Reward Mean ({buckets.width} episodes per point)')
+    if not np.isnan(buckets.last[filled]).all():
+        ax.plot(x, buckets.last[filled], '-', label='Total Reward Rolling Mean')
+    ax.set_title('Snake Agent Learning Curve')
+    ax.set_xlabel('Episode Number')
+    ax.set_ylabel('Total Episode Reward')
+    if params:
+        plt.text(0.5, -0.1, json.dumps(params), ha='center',
+                 va='baseline', transform = ax.transAxes, size='small')
+    plt.legend(loc='best')
+    save_fig(outpath, resolution=resolution)
+    plt.close(fig)
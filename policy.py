@@ -0,0 +1,82 @@
+import numpy as np
+from tabular import state_index
+
+'''
+Acting only needs the Q network's forward pass, which is a handful of NumPy
+matrix products for a network this small. Keeping it in its own module means
+that processes which only act (e.g. actor processes) never import TensorFlow.
+
+With the binary state definitions there are only 2**12 = 4096 observations, so
+a trained agent's greedy policy can be compiled once into a 4096-entry uint8
+table of actions. A TablePolicy then acts with a single array index and needs
+nothing but NumPy.
+'''
+
+def forward(policy_layers, states):
+    '''
+    runs a Q network's forward pass on an (N, state_space) array of states,
+    given its layers as (kernel, bias) pairs
+    '''
+    x = np.asarray(states, dtype=np.float32)
+    for kernel, bias in policy_layers[:-1]:
+        x = np.maximum(x @ kernel + bias, 0) # ReLU
+    kernel, bias = policy_layers[-1]
+    x = x @ kernel + bias
+    x = np.exp(x - x.max(axis=1, keepdims=True)) # softmax
+    return x/x.sum(axis=1, keepdims=True)
+
+def unpack_states(states, state_space):
+    '''
+    unpacks bit-packed (uint8) observations into an (N, state_space) float32
+    array of network inputs, and passes any other observations through
+    '''
+    states = np.asarray(states)
+    if states.dtype != np.uint8:
+        return states
+    states = states.reshape(-1, states.shape[-1])
+    return np.unpackbits(states, axis=1, count=state_space).astype(np.float32)
+
+def all_binary_states(state_space=12):
+    '''
+    returns every binary observation as a (2**state_space, state_space) array,
+    with row i being the observation that state_index maps to i
+    '''
+    bits = np.arange(state_space - 1, -1, -1)
+    return ((np.arange(2**state_space)[:, None] >> bits) & 1).astype(np.float32)
+
+def export_policy_table(agent, outpath=None):
+    '''
+    runs the agent's Q-values over every binary observation in one batch and
+    saves (and returns) the greedy action for each as a uint8 table
+    '''
+    if agent.state_space > 16:
+        raise ValueError(f'{agent.state_space} features are too many for a table')
+    table = np.argmax(agent.predict(all_binary_states(agent.state_space)),
+                      axis=1).astype(np.uint8)
+    if outpath:
+        np.save(outpath, table)
+        print(f'policy table saved to {outpath}')
+    return table
+
+class TablePolicy:
+    '''
+    a greedy policy compiled into a lookup table by export_policy_table
+    '''
+    def __init__(self, table):
+        self.table = np.asarray(table, dtype=np.uint8)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
+
+    def act(self, state):
+        '''
+        returns the action for a (1, state_space) observation
+        '''
+        return int(self.table[state_index(state)[0]])
+
+    def act_batch(self, states):
+        '''
+        returns one action per row of an (N, state_space) array of observations
+        '''
+        return self.table[state_index(states)].astype(np.int64)
@@ -0,0 +1,125 @@
+import numpy as np
+from pathlib import Path
+
+class FrameRecorder:
+    '''
+    rasterizes Snake frames straight from the game state into RGB arrays and
+    appends them to a folder of chunked, compressed .npz files
+    '''
+    BG_COLOR = (242, 225, 242)  # lavender
+    SNAKE_COLOR = (0, 128, 0)   # green
+    APPLE_COLOR = (255, 0, 0)   # red
+
+    def __init__(self, frames_dir:Path, width, height, cell_size=10,
+                 chunk_size=128, record_every=1, episodes=None):
+        # Without a frames_dir, frames can only be rasterized, not recorded.
+        self.frames_dir = Path(frames_dir) if frames_dir else None
+        if self.frames_dir:
+            self.frames_dir.mkdir(exist_ok=True, parents=True)
+        self.cols = 2*(width//2) + 1
+        self.rows = 2*(height//2) + 1
+        self.cell_size = cell_size   # side length of one cell in pixels
+        self.chunk_size = chunk_size # frames per .npz file
+        self.record_every = record_every # Only every kth step is recorded.
+        self.episodes = set(episodes) if episodes is not None else None
+        self.tiles = self.build_tiles()
+        # Frames collect in a preallocated chunk until it's full and written.
+        self.frames = np.zeros((chunk_size, self.rows*cell_size,
+                                self.cols*cell_size, 3), dtype=np.uint8)
+        self.episode_numbers = np.zeros(chunk_size, dtype=np.int64)
+        self.step_numbers = np.zeros(chunk_size, dtype=np.int64)
+        self.num_frames = 0 # frames in the current chunk
+        # Chunks written so far, including any from before a resumed run.
+        self.num_chunks = len(list(self.frames_dir.glob('frames-*.npz')))\
+            if self.frames_dir else 0
+        self.labels = np.zeros((self.rows, self.cols), dtype=np.uint8)
+
+    def build_tiles(self):
+        '''
+        draws the cell_size x cell_size pixel tile for every kind of cell:
+        0 is empty, 1 is a body chunk, 2 is the head, and 3 is the apple
+        '''
+        n = self.cell_size
+        tiles = np.empty((4, n, n, 3), dtype=np.uint8)
+        tiles[:] = self.BG_COLOR
+        # Body chunks are 80% as large as the head, which fills its cell.
+        margin = int(round(0.1*n))
+        tiles[1, margin:n-margin, margin:n-margin] = self.SNAKE_COLOR
+        tiles[2] = self.SNAKE_COLOR
+        # The apple is a circle inscribed in its cell.
+        center = (n - 1)/2
+        yy, xx = np.mgrid[:n, :n]
+        tiles[3][(yy - center)**2 + (xx - center)**2 <= (n/2)**2] = self.APPLE_COLOR
+        return tiles
+
+    def wants(self, episode_number, step_number):
+        '''
+        checks to see if a step of an episode should be recorded
+        '''
+        if self.episodes is not None and episode_number not in self.episodes:
+            return False
+        return step_number % self.record_every == 0
+
+    def rasterize(self, env, out=None):
+        '''
+        draws the current frame of a Snake environment as an RGB array
+        '''
+        labels = self.labels
+        labels.fill(0)
+        # The grid's rows run from the bottom of the screen to the top, and
+        # its two-cell WALL border is cropped off.
+        board = env.grid[2:-2, 2:-2]
+        labels[board > 0] = 1
+        for cell, label in ((env.apple_cell, 3), (env.head_cell, 2)):
+            x, y = env.to_coords(cell)
+            if abs(x) <= env.x_max and abs(y) <= env.y_max:
+                labels[y + env.y_max, x + env.x_max] = label
+        # Every label becomes a tile of pixels, with the top row drawn first.
+        tiles = self.tiles[labels[::-1]] # (rows, cols, n, n, 3)
+        frame = tiles.transpose(0, 2, 1, 3, 4).reshape(self.frames.shape[1:])
+        if out is None:
+            return frame
+        out[:] = frame
+        return out
+
+    def record(self, env):
+        '''
+        rasterizes the environment's current frame into the current chunk if
+        this step should be recorded
+        '''
+        if not self.wants(env.episode_number, env.step_number):
+            return
+        self.rasterize(env, out=self.frames[self.num_frames])
+        self.episode_numbers[self.num_frames] = env.episode_number
+        self.step_numbers[self.num_frames] = env.step_number
+        self.num_frames += 1
+        if self.num_frames == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        writes the frames collected so far to the next chunk file
+        '''
+        if self.num_frames == 0:
+            return
+        n = self.num_frames
+        chunk_path = self.frames_dir/f'frames-{self.num_chunks:06d}.npz'
+        np.savez_compressed(chunk_path, frames=self.frames[:n],
+                            episodes=self.episode_numbers[:n],
+                            steps=self.step_numbers[:n])
+        self.num_chunks += 1
+        self.num_frames = 0
+
+    def close(self):
+        self.flush()
+
+def iter_frames(frames_dir:Path):
+    '''
+    yields (episode number, step number, RGB frame) for every recorded frame in
+    the order it was recorded, loading one chunk at a time
+    '''
+    for chunk_path in sorted(Path(frames_dir).glob('frames-*.npz')):
+        with np.load(chunk_path) as chunk:
+            frames = chunk['frames']
+            for episode, step, frame in zip(chunk['episodes'], chunk['steps'], frames):
+                yield int(episode), int(step), frame
@@ -0,0 +1,116 @@
+import turtle
+
+class TurtleRenderer:
+    '''
+    draws a Snake environment's game state with turtle graphics
+    '''
+    FONT_FAM = 'Courier'
+    FONT_SIZE = 18
+    FONT_ALIGN = 'center'
+    FONT_STYLE = 'normal'
+    HEAD_SIZE = 20              # side length of the square snake head in pixels
+    GAME_TITLE = 'Snake'
+    BG_COLOR = tuple(i/255.0 for i in (242,225,242)) # lavender
+    SNAKE_SHAPE = 'square'
+    SNAKE_COLOR = 'green'
+    SNAKE_SPEED = 'fastest'
+    APPLE_SHAPE = 'circle'
+    APPLE_COLOR = 'red'
+
+    def __init__(self, env):
+        self.env = env
+        self.pixel_w = self.HEAD_SIZE*env.WIDTH  # width of the screen in pixels
+        self.pixel_h = self.HEAD_SIZE*env.HEIGHT # height of the screen in pixels
+
+        # Create the background Screen in which the snake hunts for the apple.
+        self.win = turtle.Screen()
+        self.win.title(self.GAME_TITLE)
+        self.win.bgcolor(*self.BG_COLOR)
+        self.win.tracer(0)
+        # +32 is an eyeballed frame adjustment.
+        self.win.setup(width=self.pixel_w+32, height=self.pixel_h+32)
+
+        # Create the snake head. Body chunk turtles are created as it grows.
+        self.head = turtle.Turtle()
+        self.head.shape(self.SNAKE_SHAPE)
+        # The default turtlesize of (1.0, 1.0, 1.0) means 20-pixels width,
+        # 20-pixels height, and 1-width for the shape's outline.
+        head_size = tuple(self.HEAD_SIZE*num/20 for num in self.head.turtlesize())
+        self.head.turtlesize(*head_size)
+        self.head.speed(self.SNAKE_SPEED)
+        self.head.penup() # Pull the pen up -- no drawing when moving.
+        self.head.color(self.SNAKE_COLOR)
+        self.chunks = []
+
+        # Create the apple that the snake should hunt.
+        self.apple = turtle.Turtle()
+        self.apple.shape(self.APPLE_SHAPE)
+        self.apple.color(self.APPLE_COLOR)
+        apple_size = tuple(self.HEAD_SIZE*num/20 for num in self.apple.turtlesize())
+        self.apple.turtlesize(*apple_size)
+        self.apple.penup()
+
+        # Create a text scoreboard that will update with information.
+        self.score = turtle.Turtle()
+        self.score.color('black')
+        self.score.penup()
+        self.score.hideturtle()
+        self.score.goto(0, int(0.75*self.pixel_h/2))
+        self.scoreboard = None # the (total, best) pair currently written
+
+        # Define user controls.
+        # win.listen collects key events from TurtleScreen.
+        self.win.listen()
+        self.win.onkeypress(env.move_up, 'Up')
+        self.win.onkeypress(env.move_down, 'Down')
+        self.win.onkeypress(env.move_left, 'Left')
+        self.win.onkeypress(env.move_right, 'Right')
+
+    def append_body_chunk(self):
+        '''
+        creates a turtle to draw one more chunk of the snake's body
+        '''
+        chunk = turtle.Turtle()
+        chunk.speed(self.SNAKE_SPEED)
+        chunk.shape(self.SNAKE_SHAPE)
+        # Scale the body chunks to be 80% as large as the head.
+        body_size = tuple(0.8*self.HEAD_SIZE*num/20 for num in self.head.turtlesize())
+        chunk.turtlesize(*body_size)
+        chunk.color(self.SNAKE_COLOR)
+        chunk.penup()
+        self.chunks.append(chunk)
+
+    def write_score(self):
+        '''
+        rewrites the scoreboard if the score has changed
+        '''
+        scoreboard = (self.env.total, self.env.maximum)
+        if scoreboard == self.scoreboard:
+            return
+        self.scoreboard = scoreboard
+        self.score.clear()
+        self.score.write(f'Total: {scoreboard[0]}\tBest: {scoreboard[1]}',
+                         align=self.FONT_ALIGN,
+                         font=(self.FONT_FAM, self.FONT_SIZE, self.FONT_STYLE))
+
+    def draw(self):
+        '''
+        moves every turtle to match the environment and refreshes the screen
+        '''
+        # Grid coordinates are in units of snake heads; turtle uses pixels.
+        x, y = self.env.head
+        self.head.goto(x*self.HEAD_SIZE, y*self.HEAD_SIZE)
+        x, y = self.env.apple
+        self.apple.goto(x*self.HEAD_SIZE, y*self.HEAD_SIZE)
+        while len(self.chunks) < len(self.env.body):
+            self.append_body_chunk()
+        for i, chunk in enumerate(self.chunks):
+            if i < len(self.env.body):
+                x, y = self.env.to_coords(self.env.body[i])
+                chunk.goto(x*self.HEAD_SIZE, y*self.HEAD_SIZE)
+                chunk.showturtle()
+            else: # Hide chunks left over from a longer, previous snake.
+                chunk.hideturtle()
+        self.write_score()
+        self.win.update()
+
@@ -0,0 +1,175 @@
+import csv
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
+
+'''
+A sweep config is an ordinary config whose params may hold a list of values to
+try instead of a single value. Since layer_sizes is already a list, it's swept
+by giving a list of lists, e.g.
+    "epsilon_decay": [0.95, 0.98],
+    "layer_sizes": [[128, 128, 128], [256, 256]]
+
+A grid search runs every combination, and a random search runs a given number
+of combinations drawn at random. Each trial runs headless in its own process
+with its own seed and folder, and the trials share the machine's cores through
+a pool sized so that TensorFlow's thread pools don't oversubscribe them.
+'''
+
+LIST_PARAMS = {'layer_sizes', 'board_size'} # params whose single values can be lists
+
+def get_sweep_space(params):
+    '''
+    returns the swept params and the values to try for each
+    '''
+    space = {}
+    for key, value in params.items():
+        if not isinstance(value, list):
+            continue
+        if key in LIST_PARAMS and not any(isinstance(option, list) for option in value):
+            continue # a single list value, not a list of options
+        space[key] = value
+    return space
+
+def expand_trials(config, search='grid', num_trials=None):
+    '''
+    turns a sweep config into one config per trial, each with its own seed
+    '''
+    params = config['params']
+    space = get_sweep_space(params)
+    keys = list(space)
+    if search == 'grid':
+        combos = list(itertools.product(*space.values()))
+    elif search == 'random':
+        rng = np.random.default_rng(params.get('seed'))
+        combos = [tuple(values[rng.integers(len(values))] for values in space.values())
+                  for _ in range(num_trials if num_trials else 10)]
+    else:
+        raise ValueError(f'unknown search {search}')
+    # Every trial gets an independent seed derived from the sweep's seed.
+    seeds = np.random.SeedSequence(params.get('seed')).generate_state(len(combos))
+    trials = []
+    for index, (combo, seed) in enumerate(zip(combos, seeds)):
+        swept = dict(zip(keys, combo))
+        trial_params = {**params, **swept, 'seed':int(seed)}
+        trials.append({'index':index, 'swept':swept,
+                       'config':{**config, 'human':False, 'save_for_gif':False,
+                                 'make_gif':False, 'params':trial_params}})
+    return trials
+
+@contextmanager
+def thread_limits(num_threads):
+    '''
+    caps the thread pools of processes started inside this block, which read
+    these variables when NumPy and TensorFlow first load
+    '''
+    names = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+             'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']
+    saved = {name:os.environ.get(name) for name in names}
+    os.environ.update({name:str(num_threads) for name in names})
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def run_trial(trial, trial_dir, num_threads):
+    '''
+    trains one trial's agent in a worker process and saves its history and
+    learning curve to its own folder
+    '''
+    from agent import train_dqn, uses_tensorflow
+    config = trial['config']
+    params = config['params']
+    if uses_tensorflow(params):
+        # The thread limits came with the environment this process inherited,
+        # and TensorFlow's pools are capped again here before they are ever
+        # created. Trials that don't train a network never import it.
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(num_threads)
+    from environment import Snake, SnakeVecEnv
+    from metrics import MetricsLog
+    from plotting import plot_history
+
+    trial_dir.mkdir(exist_ok=True, parents=True)
+    with open(trial_dir/'config.json', 'w') as json_file:
+        json.dump(config, json_file, indent=4)
+    # Worker pools would start processes inside a worker process, so explore.py
+    # rejects num_workers in sweeps and trials batch their games in NumPy instead.
+    env = SnakeVecEnv(config) if params.get('num_envs', 1) > 1 else Snake(config)
+    metrics = MetricsLog(trial_dir/'metrics.csv')
+    start = time.perf_counter()
+    try:
+        history = train_dqn(env, params, metrics=metrics)
+    finally:
+        env.close()
+        metrics.close()
+    elapsed = time.perf_counter() - start
+    with open(trial_dir/'history.json', 'w') as json_file:
+        json.dump(history, json_file)
+    plot_history(history, outpath=trial_dir/'learning-curve.png', params=params)
+    tail = history[-max(len(history)//10, 1):]
+    return {'trial':trial['index'], 'seed':params['seed'],
+            **{key:json.dumps(value) if isinstance(value, list) else value
+               for key, value in trial['swept'].items()},
+            'mean_reward':float(np.mean(history)), 'max_reward':max(history),
+            'final_mean_reward':float(np.mean(tail)),
+            'seconds':round(elapsed, 1), 'folder':trial_dir.name, 'history':history}
+
+def run_sweep(trials, sweep_dir:Path, num_threads=1, num_workers=None):
+    '''
+    Runs every trial on a process pool with num_threads CPU threads each and
+    returns their results in trial order. By default the pool has one worker
+    per num_threads cores.
+    '''
+    sweep_dir.mkdir(exist_ok=True, parents=True)
+    if num_workers is None:
+        num_workers = max(1, (os.cpu_count() or 1)//num_threads)
+    num_workers = min(num_workers, len(trials))
+    results = []
+    print(f'running {len(trials)} trials on {num_workers} processes')
+    # The worker processes inherit these limits when they're started.
+    with thread_limits(num_threads):
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 mp_context=mp.get_context('spawn')) as pool:
+            futures = {pool.submit(run_trial, trial,
+                                   sweep_dir/f'trial-{trial["index"]:03d}',
+                                   num_threads):trial for trial in trials}
+            for future in as_completed(futures):
+                trial = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f'ERROR: trial {trial["index"]} ({trial["swept"]}) failed: {e}')
+                    continue
+                print(f'finished trial {result["trial"]:>3} {trial["swept"]} '
+                      f'final mean reward {result["final_mean_reward"]:.1f}')
+                results.append(result)
+    return sorted(results, key=lambda result: result['trial'])
+
+def write_summary(results, outpath:Path):
+    '''
+    writes one row per trial to a csv file and prints the trials from best to
+    worst final mean reward
+    '''
+    if not results:
+        print('ERROR: no trials finished')
+        return
+    columns = [key for key in results[0] if key != 'history']
+    with open(outpath, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+    print(f'summary saved to {outpath}')
+    for result in sorted(results, key=lambda result: -result['final_mean_reward']):
+        print('  '.join(f'{key}={result[key]}' for key in columns))
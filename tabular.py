@@ -0,0 +1,120 @@
+import numpy as np
+from instrumentation import NULL_TIMER
+from memory import ReplayBuffer, PrioritizedReplayBuffer
+
+'''
+The 'default', 'no_dir', and 'no_body' state definitions are 12 binary
+features, so there are only 2**12 = 4096 states. Packing a state's bits into an
+integer indexes a 4096 x 4 table of Q-values directly, which learns the same
+Bellman update as the DQN without a network in between: acting is a row
+lookup and a replay minibatch is a handful of vectorized NumPy operations.
+'''
+
+BINARY_STATE_DEFINITIONS = {'default', 'no_dir', 'no_body'}
+
+def state_index(states):
+    '''
+    packs each row of binary features into an integer, with the first feature
+    as the most significant bit
+    '''
+    states = np.asarray(states)
+    states = states.reshape(-1, states.shape[-1])
+    weights = 1 << np.arange(states.shape[1] - 1, -1, -1, dtype=np.int64)
+    return (states > 0.5) @ weights
+
+class TabularQ:
+    '''
+    a Q-table agent with the same act/remember/replay interface as the DQN
+    '''
+    def __init__(self, env, params, memory_dir=None):
+        if env.state_definition_type not in BINARY_STATE_DEFINITIONS:
+            raise ValueError(f'a Q-table needs binary states, not {env.state_definition_type}')
+        self.action_space = env.action_space
+        self.state_space = env.state_space
+        self.epsilon = params['epsilon']
+        self.gamma = params['gamma']
+        self.batch_size = params['batch_size']
+        self.epsilon_min = params['epsilon_min']
+        self.epsilon_decay = params['epsilon_decay']
+        self.alpha = params.get('alpha', 0.1) # the Q-table's learning rate
+        self.rng = np.random.default_rng(params.get('seed'))
+        self.prioritized = params.get('prioritized_replay', False)
+        if self.prioritized:
+            self.memory = PrioritizedReplayBuffer(params.get('memory_size', 2500), self.state_space,
+                                                  alpha=params.get('priority_alpha', 0.6),
+                                                  beta=params.get('priority_beta', 0.4),
+                                                  beta_increment=params.get('priority_beta_increment', 0.001),
+                                                  seed=params.get('seed'), memmap_dir=memory_dir)
+        else:
+            self.memory = ReplayBuffer(params.get('memory_size', 2500), self.state_space,
+                                       seed=params.get('seed'), memmap_dir=memory_dir)
+        self.q_table = np.zeros((2**self.state_space, self.action_space))
+        self.timer = NULL_TIMER
+
+    def predict(self, states):
+        '''
+        looks up the Q-values of an (N, state_space) array of states
+        '''
+        return self.q_table[state_index(states)]
+
+    def remember(self, state, action, reward, next_state, done):
+        '''
+        adds one transition (or a batch with one row per transition) to the
+        replay memory
+        '''
+        self.memory.add(state, action, reward, next_state, done)
+
+    def act(self, state):
+        '''
+        moves in a random direction or the direction with the highest Q-value
+        '''
+        if self.rng.random() <= self.epsilon:
+            return int(self.rng.integers(self.action_space))
+        return int(np.argmax(self.predict(state)[0]))
+
+    def act_batch(self, states):
+        '''
+        picks one action per row of an (N, state_space) array of states
+        '''
+        actions = self.rng.integers(self.action_space, size=len(states))
+        greedy = self.rng.random(len(states)) > self.epsilon
+        if greedy.any():
+            actions[greedy] = np.argmax(self.predict(states[greedy]), axis=1)
+        return actions
+
+    def replay(self):
+        '''
+        applies the Q-learning update to a minibatch from the replay memory and
+        returns whether there were enough samples to do so
+        '''
+        if len(self.memory) < self.batch_size:
+            return False
+        replay_start = start = self.timer.now()
+        weights = 1.0
+        if self.prioritized:
+            states, actions, rewards, next_states, dones, indices, weights =\
+                self.memory.sample(self.batch_size)
+        else:
+            states, actions, rewards, next_states, dones =\
+                self.memory.sample(self.batch_size)
+        self.timer.add('agent.replay/sample', start)
+
+        start = self.timer.now()
+        rows, next_rows = state_index(states), state_index(next_states)
+        targets = rewards + self.gamma*self.q_table[next_rows].max(axis=1)*(1 - dones)
+        td_errors = targets - self.q_table[rows, actions]
+        # np.add.at applies every update, even when a state-action pair shows
+        # up more than once in the same minibatch.
+        np.add.at(self.q_table, (rows, actions), self.alpha*weights*td_errors)
+        self.timer.add('agent.replay/train_step', start)
+        if self.prioritized:
+            self.memory.update_priorities(indices, td_errors)
+        self.timer.add('agent.replay', replay_start)
+        return True
+
+    def decay_epsilon(self):
+        '''
+        shrinks the exploration rate after a replay
+        '''
+        if self.epsilon > self.epsilon_min:
+            self.epsilon *= self.epsilon_decay
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from agent import train_dqn
+from environment import Snake
+from policy import unpack_states
+from trajectory import TrajectoryDataset
+
+'''
+Checks that the observations a trajectory log stores are the ones train_dqn
+actually played. Run with `python -m pytest`.
+'''
+
+def make_config(trajectory_dir, state_definition_type):
+    return {'human':False, 'save_for_gif':False, 'make_gif':False,
+            'record_trajectories':True, 'record_observations':True,
+            'trajectory_dir':trajectory_dir,
+            'params':{'epsilon':1.0, 'gamma':0.95, 'batch_size':16,
+                      'epsilon_min':0.01, 'epsilon_decay':0.98,
+                      'learning_rate':0.001, 'layer_sizes':[16, 16],
+                      'memory_size':1000, 'num_episodes':3, 'max_steps':50,
+                      'state_definition_type':state_definition_type,
+                      'board_size':8, 'seed':0, 'backend':'numpy'}}
+
+@pytest.mark.parametrize('state_definition_type', ['default', 'grid'])
+def test_stored_observations_match_played_states(tmp_path, state_definition_type):
+    config = make_config(tmp_path/'trajectories', state_definition_type)
+    env = Snake(config)
+    # Keep a copy of every observation the environment hands to train_dqn.
+    played = []
+    reset, step = env.reset, env.step
+    def record_reset(*args, **kwargs):
+        state = reset(*args, **kwargs)
+        played.append([np.array(state).reshape(-1)])
+        return state
+    def record_step(*args, **kwargs):
+        state, reward, done, info = step(*args, **kwargs)
+        played[-1].append(np.array(state).reshape(-1))
+        return state, reward, done, info
+    env.reset, env.step = record_reset, record_step
+    train_dqn(env, config['params'])
+    env.close()
+
+    dataset = TrajectoryDataset(tmp_path/'trajectories')
+    assert len(dataset) == len(played) == config['params']['num_episodes']
+    for i, episode in enumerate(played):
+        states = unpack_states(np.array(episode), env.state_space).astype(np.float32)
+        np.testing.assert_array_equal(dataset.get_observations(i), states)
+        stored_states, _, _, stored_next_states, _ = dataset.get_transitions(i)
+        np.testing.assert_array_equal(stored_states, states[:-1])
+        np.testing.assert_array_equal(stored_next_states, states[1:])
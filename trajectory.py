@@ -0,0 +1,263 @@
+import json
+import numpy as np
+from pathlib import Path
+from policy import unpack_states
+
+'''
+A trajectory log is a folder of append-only binary files:
+
+- episodes.bin holds one EPISODE_DTYPE record per finished episode.
+- actions.bin holds every action as one uint8, episode after episode.
+- observations.bin (optional) holds every observation with its features packed
+  into bits, including each episode's initial observation.
+- rewards.bin (optional, written along with observations.bin) holds every
+  reward as one int8.
+- meta.json describes the environment that wrote the log.
+
+Every episode starts from a known seed and apple, so its actions are enough to
+replay it exactly. Observations and rewards are only stored so that offline
+training doesn't have to replay the game.
+'''
+
+EPISODE_DTYPE = np.dtype([
+    ('seed', np.uint64),    # reseeds the environment's RNG at the start
+    ('apple_x', np.int16),  # where the first apple was
+    ('apple_y', np.int16),
+    ('offset', np.int64),   # index of the episode's first action
+    ('length', np.int64),   # number of actions
+    ('apples', np.int64),   # number of apples eaten
+    ('done', np.bool_)      # whether the last action ended the game
+])
+
+class TrajectoryWriter:
+    '''
+    records the episodes that a Snake environment plays into a trajectory log
+    '''
+    def __init__(self, trajectory_dir:Path, env, record_observations=False):
+        self.trajectory_dir = Path(trajectory_dir)
+        self.trajectory_dir.mkdir(exist_ok=True, parents=True)
+        if record_observations and env.state_definition_type == 'apple_coords':
+            raise ValueError('only binary observations can be packed into bits')
+        self.record_observations = record_observations
+        meta = {'state_definition_type':env.state_definition_type,
+                'state_space':env.state_space, 'width':env.WIDTH,
+                'height':env.HEIGHT, 'observations':record_observations}
+        with open(self.trajectory_dir/'meta.json', 'w') as f:
+            json.dump(meta, f)
+        # The files are opened for appending, so nothing already written is
+        # ever rewritten.
+        self.files = {name:open(self.trajectory_dir/f'{name}.bin', 'ab') for name in
+                      ['episodes', 'actions'] +
+                      (['observations', 'rewards'] if record_observations else [])}
+        self.offset = self.files['actions'].tell() # actions written so far
+        self.episode = None
+
+    def begin_episode(self, seed, apple, observation):
+        '''
+        starts recording an episode that begins from the given seed, apple,
+        and initial observation
+        '''
+        self.episode = np.zeros((), dtype=EPISODE_DTYPE)
+        self.episode['seed'] = seed
+        self.episode['apple_x'], self.episode['apple_y'] = apple
+        self.episode['offset'] = self.offset
+        self.actions = []
+        self.rewards = []
+        # Observations are copied, since environments may reuse their buffers,
+        # and flattened, since they may come as (1, obs_size) rows.
+        self.observations = [np.array(observation).reshape(-1)]\
+            if self.record_observations else None
+
+    def record_step(self, action, reward, observation, done):
+        '''
+        adds one step to the current episode
+        '''
+        if self.episode is None:
+            return
+        self.actions.append(action)
+        self.rewards.append(reward)
+        self.episode['done'] = done
+        if self.record_observations:
+            self.observations.append(np.array(observation).reshape(-1))
+
+    def end_episode(self):
+        '''
+        appends the current episode to the log
+        '''
+        if self.episode is None:
+            return
+        self.episode['length'] = len(self.actions)
+        self.episode['apples'] = self.rewards.count(10)
+        self.files['actions'].write(np.array(self.actions, dtype=np.uint8).tobytes())
+        if self.record_observations:
+            observations = np.array(self.observations)
+            if observations.dtype != np.uint8: # 'grid' observations come packed.
+                observations = np.packbits(observations.astype(np.uint8), axis=-1)
+            self.files['observations'].write(observations.tobytes())
+            self.files['rewards'].write(np.array(self.rewards, dtype=np.int8).tobytes())
+        # The episode record goes last, so an interrupted write never leaves a
+        # record that points past the end of the actions.
+        self.files['episodes'].write(self.episode.tobytes())
+        for f in self.files.values():
+            f.flush()
+        self.offset += len(self.actions)
+        self.episode = None
+
+    def close(self):
+        self.end_episode()
+        for f in self.files.values():
+            f.close()
+
+class TrajectoryDataset:
+    '''
+    memory-maps a trajectory log so that its episodes can be replayed, rendered,
+    or streamed as training batches without loading the whole log
+    '''
+    def __init__(self, trajectory_dir:Path):
+        self.trajectory_dir = Path(trajectory_dir)
+        with open(self.trajectory_dir/'meta.json') as f:
+            self.meta = json.load(f)
+        self.episodes = self.load('episodes', EPISODE_DTYPE)
+        self.actions = self.load('actions', np.uint8)
+        self.observations = self.rewards = None
+        if self.meta['observations']:
+            packed_size = (self.meta['state_space'] + 7)//8
+            self.observations = self.load('observations', np.uint8).reshape(-1, packed_size)
+            self.rewards = self.load('rewards', np.int8)
+
+    def load(self, name, dtype):
+        '''
+        memory-maps one of the log's files (np.memmap can't map empty files)
+        '''
+        fpath = self.trajectory_dir/f'{name}.bin'
+        if fpath.stat().st_size == 0:
+            return np.zeros(0, dtype=dtype)
+        # A writer may be partway through appending, so only whole records count.
+        count = fpath.stat().st_size//np.dtype(dtype).itemsize
+        return np.memmap(fpath, dtype=dtype, mode='r', shape=(count,))
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def make_env(self, config=None):
+        '''
+        creates a Snake environment that plays by the same rules as the one that
+        wrote the log
+        '''
+        from environment import Snake
+        config = dict(config) if config else {}
+        config.update({'human':False, 'save_for_gif':False,
+                       'params':{**config.get('params', {}),
+                                 'state_definition_type':self.meta['state_definition_type'],
+                                 'board_size':[self.meta['width'], self.meta['height']]}})
+        return Snake(config)
+
+    def get_actions(self, i):
+        episode = self.episodes[i]
+        return self.actions[episode['offset']:episode['offset'] + episode['length']]
+
+    def replay(self, i, env=None, callback=None):
+        '''
+        Plays episode i again in env and yields (state, action, reward,
+        next_state, done) for each step. The replay is exact, so its rewards
+        match the ones that were recorded.
+
+        callback (function): an optional function called with env after the
+                             reset and after every step, e.g. to draw frames
+        '''
+        env = env if env is not None else self.make_env()
+        episode = self.episodes[i]
+        state = env.reset(seed=int(episode['seed']),
+                          apple=(int(episode['apple_x']), int(episode['apple_y'])))
+        if callback:
+            callback(env)
+        for action in self.get_actions(i):
+            next_state, reward, done, _ = env.step(int(action))
+            if callback:
+                callback(env)
+            yield state, int(action), reward, next_state, done
+            state = next_state
+
+    def get_observations(self, i):
+        '''
+        unpacks the length+1 stored observations of episode i
+        '''
+        episode = self.episodes[i]
+        # Each earlier episode also stored its initial observation.
+        start = episode['offset'] + i
+        packed = self.observations[start:start + episode['length'] + 1]
+        return np.unpackbits(packed, axis=1,
+                             count=self.meta['state_space']).astype(np.float32)
+
+    def get_transitions(self, i, env=None):
+        '''
+        returns episode i as arrays of states, actions, rewards, next_states,
+        and dones, read from the stored observations when there are any and
+        replayed otherwise
+        '''
+        episode = self.episodes[i]
+        if self.observations is None:
+            states, actions, rewards, next_states, dones = zip(*self.replay(i, env))
+            state_space = self.meta['state_space']
+            return unpack_states(np.array(states), state_space).astype(np.float32),\
+                np.array(actions, dtype=np.int64), np.array(rewards, dtype=np.float32),\
+                unpack_states(np.array(next_states), state_space).astype(np.float32),\
+                np.array(dones, dtype=np.float32)
+        observations = self.get_observations(i)
+        start = episode['offset']
+        dones = np.zeros(episode['length'], dtype=np.float32)
+        dones[-1] = episode['done']
+        return observations[:-1], self.get_actions(i).astype(np.int64),\
+            self.rewards[start:start + episode['length']].astype(np.float32),\
+            observations[1:], dones
+
+    def iter_batches(self, batch_size, episodes=None, env=None, seed=None):
+        '''
+        Streams (states, actions, rewards, next_states, dones) batches of the
+        given episodes (every episode by default) in a shuffled order, one
+        episode at a time, e.g. to pretrain or evaluate a DQN offline.
+
+        Transitions are shuffled within a buffer of whole episodes that is
+        drained whenever it holds at least batch_size transitions, and a
+        smaller final batch is yielded if any transitions are left over.
+        '''
+        rng = np.random.default_rng(seed)
+        episodes = np.arange(len(self)) if episodes is None else np.asarray(episodes)
+        pending = []
+        num_pending = 0
+        for i in rng.permutation(episodes):
+            if self.episodes[i]['length'] == 0:
+                continue
+            pending.append(self.get_transitions(i, env))
+            num_pending += self.episodes[i]['length']
+            if num_pending < batch_size:
+                continue
+            fields = [np.concatenate(field) for field in zip(*pending)]
+            order = rng.permutation(num_pending)
+            num_full = num_pending//batch_size*batch_size
+            for start in range(0, num_full, batch_size):
+                yield tuple(field[order[start:start + batch_size]] for field in fields)
+            pending = [tuple(field[order[num_full:]] for field in fields)]
+            num_pending -= num_full
+        if num_pending:
+            yield tuple(np.concatenate(field) for field in zip(*pending))
+
+    def make_gif(self, i, outpath:Path, env=None):
+        '''
+        replays episode i and streams its frames into a gif
+        '''
+        from PIL import Image
+        from recorder import FrameRecorder
+        from gif_creator import GifWriter, make_palette
+        env = env if env is not None else self.make_env()
+        # The recorder only rasterizes here; nothing goes to a frame store.
+        recorder = FrameRecorder(None, env.WIDTH, env.HEIGHT, chunk_size=1)
+        palette = make_palette([recorder.BG_COLOR, recorder.SNAKE_COLOR,
+                                recorder.APPLE_COLOR])
+        writer = GifWriter(Path(outpath), palette=palette)
+        try:
+            for _ in self.replay(i, env, callback=lambda env:
+                                 writer.append(Image.fromarray(recorder.rasterize(env)))):
+                pass
+        finally:
+            writer.close()
@@ -0,0 +1,139 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from environment import Snake, get_board_size, get_observation_spec
+
+def get_record_dtype(obs_size, obs_dtype=np.float32):
+    '''
+    describes the block of shared memory that one worker reads and writes
+    '''
+    return np.dtype([
+        ('action', np.int64),                     # written by the trainer
+        ('observation', obs_dtype, (obs_size,)),  # the next observation
+        ('terminal', obs_dtype, (obs_size,)),     # the last observation of a finished game
+        ('reward', np.int64),
+        ('done', np.bool_),
+        ('truncated', np.bool_)
+    ])
+
+def run_worker(conn, shm_name, index, num_workers, config):
+    '''
+    plays one Snake game in a worker process, exchanging observations and
+    actions through shared memory and waiting on a pipe for each command
+    '''
+    env = Snake(config)
+    max_steps = config['params'].get('max_steps')
+    shm = shared_memory.SharedMemory(name=shm_name)
+    records = np.ndarray((num_workers,), dtype=get_record_dtype(env.obs_size, env.obs_dtype),
+                         buffer=shm.buf)
+    record = records[index:index+1] # a view, so writes land in shared memory
+    step_num = 0
+    try:
+        while True:
+            command = conn.recv_bytes()
+            if command == b'step':
+                state, reward, done, _ = env.step(int(record['action'][0]))
+                step_num += 1
+                truncated = not done and bool(max_steps) and step_num >= max_steps
+                record['reward'] = reward
+                record['done'] = done
+                record['truncated'] = truncated
+                if done or truncated: # Reset finished games right away.
+                    record['terminal'] = state
+                    state = env.reset()
+                    step_num = 0
+                record['observation'] = state
+            elif command == b'reset':
+                record['observation'] = env.reset()
+                step_num = 0
+            else: # b'close'
+                break
+            conn.send_bytes(b'')
+    finally:
+        del record, records # Views must go before the memory can close.
+        shm.close()
+
+class SnakeWorkerPool:
+    '''
+    a batch of Snake games that each run in their own process and share their
+    observations, rewards, and dones with the trainer through shared memory
+    '''
+    def __init__(self, config, num_workers=None):
+        params = config['params']
+        self.num_envs = num_workers if num_workers else params['num_workers']
+        self.action_space = 4
+        self.state_definition_type = params['state_definition_type']
+        self.state_space, self.obs_size, self.obs_dtype =\
+            get_observation_spec(self.state_definition_type, *get_board_size(params))
+
+        dtype = get_record_dtype(self.obs_size, self.obs_dtype)
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=dtype.itemsize*self.num_envs)
+        self.records = np.ndarray((self.num_envs,), dtype=dtype, buffer=self.shm.buf)
+        self.records.fill(0)
+
+        # Every worker gets an independent seed derived from the run's seed.
+        seeds = np.random.SeedSequence(params.get('seed')).generate_state(self.num_envs)
+        # Spawned (rather than forked) workers don't inherit TensorFlow state.
+        ctx = mp.get_context('spawn')
+        self.conns = []
+        self.processes = []
+        for index, seed in enumerate(seeds):
+            worker_config = {**config, 'human':False, 'save_for_gif':False,
+                             'params':{**params, 'seed':int(seed)}}
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=run_worker, daemon=True,
+                                  args=(child_conn, self.shm.name, index,
+                                        self.num_envs, worker_config))
+            process.start()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+
+    def broadcast(self, command):
+        '''
+        sends a command to every worker and waits for all of them to finish
+        '''
+        for conn in self.conns:
+            conn.send_bytes(command)
+        for conn in self.conns:
+            conn.recv_bytes()
+
+    def reset(self):
+        '''
+        resets every game and returns a zero-copy (K, obs_size) view of the initial
+        observations
+        '''
+        self.broadcast(b'reset')
+        return self.records['observation']
+
+    def step(self, actions):
+        '''
+        Advances every worker's game by one time step. Finished games are reset
+        by their workers, just like in SnakeVecEnv.
+
+        The returned observations, rewards, and dones are zero-copy views of
+        shared memory that the next step overwrites, so copy anything that
+        needs to be kept.
+        '''
+        self.records['action'] = actions
+        self.broadcast(b'step')
+        finished = np.flatnonzero(self.records['done'] | self.records['truncated'])
+        info = {'truncated':self.records['truncated'],
+                'terminal_observation':self.records['terminal'][finished]}
+        return self.records['observation'], self.records['reward'],\
+            self.records['done'], info
+
+    def close(self):
+        '''
+        stops the workers and frees the shared memory
+        '''
+        for conn in self.conns:
+            try:
+                conn.send_bytes(b'close')
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+        self.records = None
+        self.shm.close()
+        self.shm.unlink()